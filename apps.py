@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PyusiteConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "pyusite"
+
+    def ready(self):
+        from . import signals
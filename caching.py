@@ -0,0 +1,875 @@
+import copy
+import hashlib
+import logging
+import time as clock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, parse_http_date_safe
+from . import purge
+from .compression import choose_encoding, compress, minify_html
+from .localcache import LocalCache, TieredCache
+from .rendering import get_renderer_version
+
+logger = logging.getLogger(__name__)
+
+TAG_PREFIX = "pyusite:tag:"
+PAGE_PREFIX = "pyusite:page:"
+RACK_PREFIX = "pyusite:rack:"
+TREE_PREFIX = "pyusite:tree:"
+STRUCTURE_PREFIX = "pyusite:structure:"
+GENERATION_KEY = "pyusite:generation"
+LOCK_PREFIX = "pyusite:lock:"
+PURGE_COUNT_KEY = "pyusite:purges"
+
+# The request headers kept when a page is rendered again in the background,
+# which must not include the visitor's cookies or conditional headers
+REFRESH_HEADERS = (
+    "HTTP_HOST",
+    "HTTP_X_FORWARDED_HOST",
+    "HTTP_X_FORWARDED_PORT",
+    "HTTP_X_FORWARDED_PROTO",
+)
+
+# The foreign keys through which a change to a model affects what is rendered
+# for its parent, for example a hanger added to a rack changes the rack
+PARENT_FIELDS = {
+    "hanger": ["rack"],
+    "rack": ["section"],
+    "section": ["page"],
+    "menuitem": ["menu"],
+    "menupage": ["menu", "page"],
+}
+
+# The models that have no modification dates of their own but shape what is
+# rendered, for which the time of the last change to any of their rows is
+# kept in the cache instead
+STRUCTURE_MODELS = ("hanger", "menu", "menuitem", "menupage", "page", "rack", "section")
+
+
+def get_cache_settings():
+    return settings.PYUSITE.get("PAGE_CACHE", {})
+
+
+def page_cache_enabled():
+    return bool(get_cache_settings().get("ENABLED", False))
+
+
+def purging_enabled():
+    return page_cache_enabled() or purge.edge_cache_enabled()
+
+
+_local_cache = None
+
+
+def get_local_cache():
+    """
+    The in-process cache in front of the shared one, or None if
+    PAGE_CACHE["LOCAL_MAX_BYTES"] does not give it a size
+    """
+    global _local_cache
+
+    max_bytes = get_cache_settings().get("LOCAL_MAX_BYTES", 0)
+    timeout = get_cache_settings().get("LOCAL_TIMEOUT", 60)
+    if not max_bytes:
+        return None
+    if (
+        _local_cache is None
+        or _local_cache.max_bytes != max_bytes
+        or _local_cache.timeout != timeout
+    ):
+        _local_cache = LocalCache(max_bytes, timeout)
+
+    return _local_cache
+
+
+def get_shared_cache():
+    return caches[get_cache_settings().get("CACHE_ALIAS", "default")]
+
+
+def get_cache():
+    local_cache = get_local_cache()
+    if local_cache is None:
+        return get_shared_cache()
+
+    # The versions, counters and locks must be the same for every process,
+    # so they are never kept locally
+    return TieredCache(
+        get_shared_cache(),
+        local_cache,
+        (TAG_PREFIX, PURGE_COUNT_KEY, STRUCTURE_PREFIX, GENERATION_KEY, LOCK_PREFIX),
+    )
+
+
+def bump_generation():
+    # Tells the other processes to empty their local caches
+    if get_local_cache() is not None:
+        cache = get_shared_cache()
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, 1, None)
+
+
+def sync_local_cache(**kwargs):
+    """
+    Empties the local cache if anything has changed since it was filled.
+    Called once at the start of each request
+    """
+    local_cache = get_local_cache()
+    if local_cache is not None:
+        local_cache.sync(get_shared_cache().get(GENERATION_KEY))
+
+
+def get_timeout(visibility_transition=None):
+    """
+    The configured timeout, shortened if needed so that the cached entry
+    expires at the start of the day on which something it includes is due to
+    be published or to expire
+    """
+    timeout = get_cache_settings().get("TIMEOUT", 300)
+
+    if visibility_transition is not None:
+        until_transition = get_seconds_until(visibility_transition)
+        timeout = (
+            until_transition if timeout is None else min(timeout, until_transition)
+        )
+
+    return timeout
+
+
+def get_seconds_until(day):
+    return max(
+        1, int((datetime.combine(day, time.min) - datetime.now()).total_seconds())
+    )
+
+
+def get_stale_timeout(timeout, visibility_transition=None):
+    """
+    How long past its timeout a cached page is kept to be served stale while
+    it is rendered again: PAGE_CACHE["STALE_TIMEOUT"], but never past the
+    start of the day on which something it includes is due to be published
+    or to expire
+    """
+    if timeout is None:
+        return 0
+
+    stale_timeout = get_cache_settings().get("STALE_TIMEOUT", 600)
+    if visibility_transition is not None:
+        stale_timeout = min(
+            stale_timeout, get_seconds_until(visibility_transition) - timeout
+        )
+
+    return max(0, stale_timeout)
+
+
+def get_site_config_version():
+    return hashlib.md5(
+        repr(sorted((key, repr(value)) for key, value in settings.PYUSITE.items())).encode()
+    ).hexdigest()[:12]
+
+
+def request_is_public(request):
+    return (
+        request.method in ("GET", "HEAD")
+        and not request.user.is_authenticated
+        and "messages" not in request.COOKIES
+    )
+
+
+def request_is_cacheable(request):
+    return page_cache_enabled() and request_is_public(request)
+
+
+def conditional_gets_enabled():
+    """
+    Whether conditional GETs are answered before rendering, which needs the
+    page cache on and a cache shared by every process, since the versions
+    of the structure models the validators are built from are kept in it.
+    With a per process cache, a save would only change the versions of the
+    process that made it
+    """
+    return page_cache_enabled() and not isinstance(get_shared_cache(), LocMemCache)
+
+
+def get_structure_versions(model_names):
+    """
+    The time of the last change to each of the models, as a timestamp.  A
+    model whose time has been evicted from the cache is taken to have
+    changed now
+    """
+    cache = get_cache()
+    keys = {STRUCTURE_PREFIX + model_name: model_name for model_name in model_names}
+
+    versions = cache.get_many(keys.keys())
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = clock.time()
+        for key in missing:
+            cache.add(key, now, None)
+        versions.update(cache.get_many(missing))
+
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump_structure_versions(model_names):
+    now = clock.time()
+    get_cache().set_many(
+        {
+            STRUCTURE_PREFIX + model_name: now
+            for model_name in model_names
+            if model_name in STRUCTURE_MODELS
+        },
+        None,
+    )
+
+
+def make_tag(model_name, pk):
+    return "{}:{}".format(model_name, pk)
+
+
+def make_page_key(request, view_name, view_kwargs):
+    # The path is included because pages link to it, for example to come
+    # back after logging in, and the same page can be shown at several paths
+    identifier = "{}|{}|{}|{}".format(
+        request.get_host(),
+        request.path,
+        view_name,
+        ",".join("{}={}".format(key, view_kwargs[key]) for key in sorted(view_kwargs)),
+    )
+    return "{}{}:{}".format(
+        PAGE_PREFIX,
+        get_site_config_version(),
+        hashlib.md5(identifier.encode()).hexdigest(),
+    )
+
+
+def make_rack_key(rack_pk):
+    return "{}{}:{}".format(RACK_PREFIX, get_site_config_version(), rack_pk)
+
+
+def make_tree_key(page_pk):
+    return "{}{}:{}".format(TREE_PREFIX, get_site_config_version(), page_pk)
+
+
+def new_version():
+    # Unlike a counter starting from 1, never the version a key had before it
+    # was evicted
+    return clock.time_ns()
+
+
+def get_tag_versions(tags):
+    """
+    The current version of each tag, which purging the tag increments.  A
+    tag whose version has been evicted from the cache gets a new one
+    """
+    cache = get_cache()
+    keys = {TAG_PREFIX + tag: tag for tag in tags}
+
+    versions = cache.get_many(keys.keys())
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        version = new_version()
+        for key in missing:
+            cache.add(key, version, None)
+        versions.update(cache.get_many(missing))
+
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def get_purge_count():
+    """
+    The number of purges so far, read before loading what is to be cached
+    and passed to cache_entries
+    """
+    cache = get_cache()
+    count = cache.get(PURGE_COUNT_KEY)
+    if count is None:
+        cache.add(PURGE_COUNT_KEY, new_version(), None)
+        count = cache.get(PURGE_COUNT_KEY)
+
+    return count
+
+
+def cache_entries(entries, timeout, purge_count):
+    """
+    Caches entries, dicts by key with the "tags" of what each includes,
+    together with the current versions of those tags, against which
+    get_entries checks them.  Nothing is cached if a purge has happened
+    since purge_count was read, since the entries may have been built from
+    what it was for.  Returns whether the entries were cached
+    """
+    cache = get_cache()
+    versions = get_tag_versions(
+        set().union(*(entry["tags"] for entry in entries.values()))
+    )
+    # Read after the versions, since purge_tags counts the purge before it
+    # increments them
+    if cache.get(PURGE_COUNT_KEY) != purge_count:
+        return False
+
+    for entry in entries.values():
+        entry["versions"] = {tag: versions.get(tag) for tag in entry["tags"]}
+    cache.set_many(entries, timeout)
+
+    return True
+
+
+def get_entries(keys, cache=None):
+    """
+    The entries cached under the keys, by key, leaving out those that
+    include something purged since they were cached
+    """
+    if cache is None:
+        cache = get_cache()
+
+    entries = cache.get_many(keys)
+    tags = set()
+    for entry in entries.values():
+        tags.update(entry.get("versions", {}))
+    versions = {
+        key[len(TAG_PREFIX) :]: version
+        for key, version in get_cache()
+        .get_many([TAG_PREFIX + tag for tag in tags])
+        .items()
+    }
+
+    return {
+        key: entry
+        for key, entry in entries.items()
+        if entry_is_current(entry, versions)
+    }
+
+
+def entry_is_current(entry, versions):
+    entry_versions = entry.get("versions")
+    return entry_versions is not None and all(
+        version is not None and versions.get(tag) == version
+        for tag, version in entry_versions.items()
+    )
+
+
+def get_page(key):
+    cached = get_entries([key]).get(key)
+
+    if (
+        cached is not None
+        and not page_is_fresh(cached)
+        and get_local_cache() is not None
+    ):
+        # Another process may already have rendered it again
+        shared = get_entries([key], get_shared_cache()).get(key)
+        if shared is not None and page_is_fresh(shared):
+            get_local_cache().set(key, shared)
+            cached = shared
+
+    return cached
+
+
+def page_is_fresh(cached):
+    fresh_until = cached.get("fresh_until")
+    return fresh_until is None or fresh_until > clock.time()
+
+
+def set_page(
+    key, response, tags, visibility_transition=None, content=None, purge_count=None
+):
+    """
+    Caches a rendered page, minified if it is HTML and PAGE_CACHE["MINIFY"]
+    is on, and, if PAGE_CACHE["COMPRESS"] is on, with compressed copies to
+    send to the browsers that accept them.  purge_count is get_purge_count
+    as read before the page was rendered.  Returns the entry, whether or not
+    it was cached
+    """
+    if content is None:
+        content = response.content
+    if get_cache_settings().get("MINIFY", True) and response[
+        "Content-Type"
+    ].startswith("text/html"):
+        content = minify_html(content.decode(response.charset)).encode(
+            response.charset
+        )
+
+    timeout = get_timeout(visibility_transition)
+    entry = {
+        "content": content,
+        "encodings": (
+            compress(content) if get_cache_settings().get("COMPRESS", True) else {}
+        ),
+        "content_type": response["Content-Type"],
+        "etag": response.get("ETag"),
+        "last_modified": response.get("Last-Modified"),
+        "tags": sorted(tags),
+        "fresh_until": None if timeout is None else clock.time() + timeout,
+    }
+    cache_entries(
+        {key: entry},
+        (
+            None
+            if timeout is None
+            else timeout + get_stale_timeout(timeout, visibility_transition)
+        ),
+        purge_count,
+    )
+
+    return entry
+
+
+def acquire_render_lock(key):
+    """
+    Returns whether this request is the one to render the page, so that
+    however many requests find it missing or stale at once, it is only
+    rendered once.  The lock expires after PAGE_CACHE["LOCK_TIMEOUT"]
+    seconds in case its holder never releases it
+    """
+    return get_cache().add(
+        LOCK_PREFIX + key, 1, get_cache_settings().get("LOCK_TIMEOUT", 30)
+    )
+
+
+def release_render_lock(key):
+    get_cache().delete(LOCK_PREFIX + key)
+
+
+def release_render_lock_after(streaming_content, key):
+    try:
+        yield from streaming_content
+    finally:
+        release_render_lock(key)
+
+
+def wait_for_page(key):
+    """
+    Waits for the page that another request is rendering, for as long as
+    that request holds the lock.  Returns None if the page was not cached,
+    for example because its render failed
+    """
+    deadline = clock.monotonic() + get_cache_settings().get("LOCK_TIMEOUT", 30)
+    while clock.monotonic() < deadline:
+        clock.sleep(0.05)
+        cached = get_page(key)
+        if cached is not None:
+            return cached
+        if get_cache().get(LOCK_PREFIX + key) is None:
+            return None
+
+    return None
+
+
+_refresh_executor = None
+
+
+def get_refresh_executor():
+    global _refresh_executor
+
+    if _refresh_executor is None:
+        _refresh_executor = ThreadPoolExecutor(
+            max_workers=get_cache_settings().get("REFRESH_WORKERS", 2),
+            thread_name_prefix="pyusite-refresh",
+        )
+
+    return _refresh_executor
+
+
+def make_refresh_request(request):
+    """
+    A copy of a request, as an anonymous visitor without cookies or
+    conditional headers would have made it, to render the page again with
+    """
+    refresh_request = copy.copy(request)
+    refresh_request.META = {
+        key: value
+        for key, value in request.META.items()
+        if not key.startswith("HTTP_") or key in REFRESH_HEADERS
+    }
+    refresh_request.COOKIES = {}
+    refresh_request.user = AnonymousUser()
+    refresh_request.pyusite_refresh = True
+
+    return refresh_request
+
+
+def refresh_page(key, view, request, args, kwargs):
+    try:
+        # A streamed page is only cached once it has all been read
+        view(request, *args, **kwargs).getvalue()
+    except Exception:
+        # The stale page is served until the lock expires and the next
+        # request tries again, rather than asking a failing database on
+        # every request
+        logger.exception("Could not refresh the cached page %s", request.path)
+    else:
+        release_render_lock(key)
+    finally:
+        connection.close()
+
+
+def purge_tags(tags):
+    """
+    Makes every cached entry that includes one of the tags out of date, by
+    incrementing their versions.  Each is a key of its own, incremented
+    atomically, so purges and renders running at once never lose each
+    other's writes
+    """
+    cache = get_cache()
+
+    # Counted first, so that an entry built from what was there before the
+    # change, whose tag versions were read after it, is not cached
+    try:
+        cache.incr(PURGE_COUNT_KEY)
+    except ValueError:
+        cache.add(PURGE_COUNT_KEY, new_version(), None)
+
+    for tag in tags:
+        try:
+            cache.incr(TAG_PREFIX + tag)
+        except ValueError:
+            # Evicted, so it gets a new version when it is next read, which
+            # no cached entry has
+            pass
+
+
+def purge_tags_on_commit(tags):
+    """
+    Once the transaction commits, purges the tagged pages from the page cache
+    and from the CDN or reverse proxy in front of the site
+    """
+
+    def purge_everywhere():
+        if page_cache_enabled():
+            purge_tags(tags)
+        purge.purge_tags(tags)
+
+    transaction.on_commit(purge_everywhere)
+
+
+def purge_instances(instances):
+    """
+    Purges the cached pages that include the instances and records the
+    change to their models, for instances written without sending post_save,
+    for example by bulk_create or bulk_update
+    """
+    if not instances:
+        return
+
+    model_names = {instance._meta.model_name for instance in instances}
+    transaction.on_commit(lambda: bump_structure_versions(model_names))
+
+    if purging_enabled():
+        tags = set()
+        for instance in instances:
+            tags.update(get_instance_tags(instance))
+        purge_tags_on_commit(tags)
+
+    transaction.on_commit(bump_generation)
+
+
+def get_instance_tags(instance, previous_parents=None):
+    """
+    The tags of the cached pages that have to be purged when an instance is
+    saved or deleted: the instance itself and its parents, both current and,
+    if given, as they were before the save
+    """
+    model_name = instance._meta.model_name
+    tags = {make_tag(model_name, instance.pk)}
+
+    for field_name in PARENT_FIELDS.get(model_name, []):
+        parent_id = getattr(instance, "{}_id".format(field_name))
+        if parent_id is not None:
+            tags.add(make_tag(field_name, parent_id))
+        if previous_parents and previous_parents.get(field_name) is not None:
+            tags.add(make_tag(field_name, previous_parents[field_name]))
+
+    if model_name == "article":
+        # Articles that are not visible are not tagged on the pages, but
+        # becoming visible changes the racks that hold them, and the
+        # sections and pages that show those racks
+        for parent_ids in instance.hanger_set.values_list(
+            "rack_id", "rack__section_id", "rack__section__page_id"
+        ):
+            for parent_name, parent_id in zip(("rack", "section", "page"), parent_ids):
+                if parent_id is not None:
+                    tags.add(make_tag(parent_name, parent_id))
+
+    if model_name == "menu":
+        tags.add("main_menus")
+
+    return tags
+
+
+def get_edge_max_age(timeout):
+    # Visibility changes at the start of each day, and nothing purges the
+    # CDN then
+    until_tomorrow = int(
+        (
+            datetime.combine(date.today(), time.min)
+            + timedelta(days=1)
+            - datetime.now()
+        ).total_seconds()
+    )
+    return max(0, min(timeout, until_tomorrow))
+
+
+def patch_edge_headers(request, response, tags):
+    """
+    Lets a CDN or reverse proxy cache the responses of public views for
+    anonymous visitors, and tells it with which tags to purge them, but
+    keeps everyone else's responses out of shared caches
+    """
+    edge_settings = purge.get_edge_settings()
+    if not purge.edge_cache_enabled():
+        return response
+
+    if not request_is_public(request):
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    if response.status_code not in (200, 304):
+        return response
+
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=get_edge_max_age(edge_settings.get("MAX_AGE", 0)),
+        s_maxage=get_edge_max_age(edge_settings.get("S_MAXAGE", 300)),
+        stale_while_revalidate=edge_settings.get("STALE_WHILE_REVALIDATE", 60),
+    )
+    if tags:
+        for header in edge_settings.get(
+            "TAG_HEADERS", list(purge.TAG_HEADER_SEPARATORS)
+        ):
+            response[header] = purge.TAG_HEADER_SEPARATORS[header].join(sorted(tags))
+
+    return response
+
+
+class PageCacheMixin:
+    """
+    Caches the rendered response of a public view for anonymous users.
+    Views add the tags of what they render to self.cache_tags so that saving
+    any of those objects purges the cached response
+    """
+
+    def get_page_cache_key(self):
+        return make_page_key(self.request, self.__class__.__name__, self.kwargs)
+
+    def get_visibility_transition(self):
+        return None
+
+    def get(self, request, *args, **kwargs):
+        self.cache_tags = set()
+
+        if not request_is_cacheable(request):
+            response = super().get(request, *args, **kwargs)
+            return self.finish_response(response)
+
+        key = self.get_page_cache_key()
+        if getattr(request, "pyusite_refresh", False):
+            return self.render_to_cache(key, request, *args, **kwargs)
+
+        cached = get_page(key)
+        if cached is not None:
+            # A stale page is served at once, and rendered again in the
+            # background by whichever request gets the lock
+            if not page_is_fresh(cached) and acquire_render_lock(key):
+                get_refresh_executor().submit(
+                    refresh_page,
+                    key,
+                    type(self).as_view(),
+                    make_refresh_request(request),
+                    args,
+                    kwargs,
+                )
+            return self.serve_cached(cached)
+
+        locked = acquire_render_lock(key)
+        if not locked:
+            cached = wait_for_page(key)
+            if cached is not None:
+                return self.serve_cached(cached)
+
+        try:
+            response = self.render_to_cache(key, request, *args, **kwargs)
+        except Exception:
+            if locked:
+                release_render_lock(key)
+            raise
+
+        if locked:
+            # A streamed page is rendered as it is sent
+            if response.streaming:
+                response.streaming_content = release_render_lock_after(
+                    response.streaming_content, key
+                )
+            else:
+                release_render_lock(key)
+
+        return self.finish_response(response)
+
+    def render_to_cache(self, key, request, *args, **kwargs):
+        """
+        Renders the page and caches it, or, if it is streamed, caches it once
+        all of it has been sent
+        """
+        purge_count = get_purge_count()
+        response = super().get(request, *args, **kwargs)
+        if response.streaming:
+            if response.status_code == 200:
+                response.streaming_content = self.stream_to_cache(
+                    key, response, response.streaming_content, purge_count
+                )
+            return response
+
+        if hasattr(response, "render"):
+            response.render()
+        if response.status_code == 200:
+            # Sent as it is cached, so it is the same as on later requests
+            response = self.response_from_cache(
+                set_page(
+                    key,
+                    response,
+                    self.cache_tags,
+                    self.get_visibility_transition(),
+                    purge_count=purge_count,
+                )
+            )
+
+        return response
+
+    def stream_to_cache(self, key, response, streaming_content, purge_count):
+        chunks = []
+        for chunk in streaming_content:
+            chunks.append(chunk)
+            yield chunk
+
+        # Tags added while the page was streamed are included
+        set_page(
+            key,
+            response,
+            self.cache_tags,
+            self.get_visibility_transition(),
+            b"".join(chunks),
+            purge_count,
+        )
+
+    def serve_cached(self, cached):
+        self.cache_tags.update(cached.get("tags", ()))
+        return self.finish_response(self.response_from_cache(cached))
+
+    def finish_response(self, response):
+        # The tags are also kept on the response for code that calls the
+        # view, such as the static export
+        response.pyusite_cache_tags = self.cache_tags
+        return patch_edge_headers(self.request, response, self.cache_tags)
+
+    def response_from_cache(self, cached):
+        encodings = cached.get("encodings", {})
+        encoding = choose_encoding(
+            self.request.META.get("HTTP_ACCEPT_ENCODING", ""), encodings
+        )
+        etag = cached.get("etag")
+
+        if encoding is None:
+            response = HttpResponse(
+                cached["content"], content_type=cached["content_type"]
+            )
+        else:
+            response = HttpResponse(
+                encodings[encoding], content_type=cached["content_type"]
+            )
+            response["Content-Encoding"] = encoding
+            # The compressed copies are not byte for byte the same
+            if etag and not etag.startswith("W/"):
+                etag = "W/" + etag
+        if encodings:
+            patch_vary_headers(response, ("Accept-Encoding",))
+
+        if etag:
+            response["ETag"] = etag
+        if cached.get("last_modified"):
+            response["Last-Modified"] = cached["last_modified"]
+
+        return get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=parse_http_date_safe(cached.get("last_modified") or ""),
+            response=response,
+        )
+
+
+class ConditionalGetMixin:
+    """
+    Answers conditional GETs from anonymous visitors with a 304 before
+    anything is rendered, if conditional_gets_enabled.  The validators are
+    built from the latest change to the content the view shows, returned by
+    get_content_modified, the versions of the structure_models, the
+    visibility date and the site configuration.  Meant for detail views,
+    whose object is fetched once for both the validators and the response
+    """
+
+    structure_models = ()
+
+    def get_content_modified(self):
+        return None
+
+    def get_validators(self):
+        today = date.today()
+        versions = get_structure_versions(self.structure_models)
+        content_modified = self.get_content_modified()
+
+        # Visibility changes at the start of each day
+        timestamps = [datetime.combine(today, time.min).timestamp()]
+        timestamps.extend(versions.values())
+        if content_modified is not None:
+            timestamps.append(content_modified.timestamp())
+
+        etag = '"{}"'.format(
+            hashlib.md5(
+                repr(
+                    (
+                        sorted(versions.items()),
+                        content_modified.isoformat() if content_modified else None,
+                        today.isoformat(),
+                        get_site_config_version(),
+                        get_renderer_version(),
+                    )
+                ).encode()
+            ).hexdigest()
+        )
+
+        return etag, int(max(timestamps))
+
+    def get_object(self, queryset=None):
+        if queryset is None and getattr(self, "object", None) is not None:
+            return self.object
+
+        return super().get_object(queryset)
+
+    def get(self, request, *args, **kwargs):
+        if not (conditional_gets_enabled() and request_is_public(request)):
+            return super().get(request, *args, **kwargs)
+
+        self.object = self.get_object()
+        etag, last_modified = self.get_validators()
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response.setdefault("ETag", etag)
+            response.setdefault("Last-Modified", http_date(last_modified))
+
+        return response
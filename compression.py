@@ -0,0 +1,80 @@
+import gzip
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Elements whose whitespace is significant, which minifying leaves as they are
+PRESERVED_RE = re.compile(
+    r"<(pre|textarea|script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Smaller responses are not worth compressing
+MIN_COMPRESS_SIZE = 200
+
+
+def collapse_whitespace(text):
+    return WHITESPACE_RE.sub(
+        lambda match: "\n" if "\n" in match.group(0) else " ", text
+    )
+
+
+def minify_html(html):
+    """
+    Collapses each run of whitespace to a newline if it includes one, or
+    else to a space, which browsers render the same, except inside pre,
+    textarea, script and style elements
+    """
+    parts = []
+    position = 0
+    for match in PRESERVED_RE.finditer(html):
+        parts.append(collapse_whitespace(html[position : match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(collapse_whitespace(html[position:]))
+
+    return "".join(parts)
+
+
+def compress(content):
+    """
+    The content compressed with each of the encodings available, most
+    compact first, as a dict by Content-Encoding
+    """
+    if len(content) < MIN_COMPRESS_SIZE:
+        return {}
+
+    encodings = {}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(content)
+    encodings["gzip"] = gzip.compress(content, compresslevel=9, mtime=0)
+
+    return encodings
+
+
+def choose_encoding(accept_encoding, encodings):
+    """
+    The first of encodings that an Accept-Encoding header accepts, or None
+    if it accepts none of them
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+
+    return None
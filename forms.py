@@ -1,23 +1,87 @@
 import datetime
+import json
 from django.conf import settings
 from django.forms import ModelForm, SelectDateWidget, inlineformset_factory, Select
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseInlineFormSet, ModelChoiceIterator
 from django.urls import reverse_lazy
 from .models import Article, Articlecomment, Imij, Page, Rack, Hanger, Section
 from django import forms
 from touglates.widgets import TouglatesRelatedSelect, SlugInput
 
 
+class AutocompleteSelect(TouglatesRelatedSelect):
+    """
+    A select that renders only its selected options.  The other options are
+    fetched from autocomplete_url as the user searches.  filters maps query
+    parameters to suffixes of the ids of other selects on the page whose
+    values narrow the search, for example {"page": "page_"} sends the value
+    of the select with id "page_" + this select's id
+    """
+
+    def __init__(self, *args, autocomplete_url=None, filters=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autocomplete_url = autocomplete_url
+        self.filters = filters or {}
+
+    class Media:
+        js = ["pyusite/edit/autocomplete.js"]
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        widget_attrs = context["widget"]["attrs"]
+        widget_attrs["data-autocomplete-url"] = str(self.autocomplete_url)
+        if self.filters:
+            widget_attrs["data-autocomplete-filters"] = json.dumps(
+                {
+                    param: prefix + widget_attrs.get("id", "")
+                    for param, prefix in self.filters.items()
+                }
+            )
+
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [str(v) for v in value if v not in (None, "")]
+        choices = self.choices
+
+        if isinstance(choices, ModelChoiceIterator):
+            field = choices.field
+            shared_objects = getattr(field, "shared_objects", None)
+            if shared_objects is not None:
+                objects = [
+                    shared_objects[int(v)]
+                    for v in selected
+                    if v.isdigit() and int(v) in shared_objects
+                ]
+            elif selected:
+                objects = choices.queryset.filter(
+                    **{"{}__in".format(field.to_field_name or "pk"): selected}
+                )
+            else:
+                objects = []
+            self.choices = [("", field.empty_label or "")] + [
+                choices.choice(obj) for obj in objects
+            ]
+        else:
+            self.choices = [("", "---------")] + [(v, v) for v in selected]
+
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = choices
+
+
 class ArticleForm(ModelForm):
-    image_select = forms.ModelChoiceField(
+    image_select = forms.CharField(
         required=False,
-        queryset=Imij.objects.all(),
-        to_field_name="markdown_code",
-        widget=TouglatesRelatedSelect(
+        widget=AutocompleteSelect(
             related_data={
                 "model_name": "Imij",
                 "app_name": "pyusite",
                 "add_url": reverse_lazy("pyusite:imij-popup"),
             },
+            autocomplete_url=reverse_lazy("pyusite:autocomplete-imij"),
         ),
         help_text="Select or add an image then copy the resulting code",
         label="select image"
@@ -88,20 +152,44 @@ class ArticleForm(ModelForm):
             # ),
         }
 
-class RackSelect(TouglatesRelatedSelect):
+class RackSelect(AutocompleteSelect):
     def create_option(
         self, name, value, label, selected, index, subindex=None, attrs=None
     ):
         option = super().create_option(
             name, value, label, selected, index, subindex, attrs
         )
-        if value:
+        if value and value.instance.section:
             option["attrs"]["data-section"] = value.instance.section.id
-            option["attrs"]["data-page"] = value.instance.section.page.id
+            if value.instance.section.page:
+                option["attrs"]["data-page"] = value.instance.section.page.id
 
         return option
 
 
+class SharedModelChoiceField(forms.ModelChoiceField):
+    """
+    A ModelChoiceField which, when a formset gives it shared_objects (a dict
+    of objects by pk shared by every form in the formset), renders and
+    validates from that dict instead of querying for each form
+    """
+
+    shared_objects = None
+
+    def to_python(self, value):
+        if self.shared_objects is None or value in self.empty_values:
+            return super().to_python(value)
+
+        try:
+            return self.shared_objects[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+
+
 class HangerForm(ModelForm):
     class Meta:
         fields = [
@@ -116,10 +204,119 @@ class HangerForm(ModelForm):
                     "model_name": "Rack",
                     "app_name": "pyusite",
                     "add_url": reverse_lazy("pyusite:rack-popup"),
-                }
-            )
+                },
+                autocomplete_url=reverse_lazy("pyusite:autocomplete-rack"),
+                filters={"page": "page_", "section": "section_"},
+            ),
+            "article": AutocompleteSelect(
+                related_data={
+                    "model_name": "Article",
+                    "app_name": "pyusite",
+                    "add_url": reverse_lazy("pyusite:article-popup"),
+                },
+                autocomplete_url=reverse_lazy("pyusite:autocomplete-article"),
+            ),
+        }
+        field_classes = {
+            "rack": SharedModelChoiceField,
+            "article": SharedModelChoiceField,
         }
 
+    def _get_validation_exclusions(self):
+        # Fields given their objects by the formset have already checked
+        # that they exist, which the model would check again with a query
+        # for each form
+        exclude = super()._get_validation_exclusions()
+        for name, field in self.fields.items():
+            if (
+                isinstance(field, SharedModelChoiceField)
+                and field.shared_objects is not None
+            ):
+                exclude.add(name)
+
+        return exclude
+
+
+class BaseSharedInlineFormSet(BaseInlineFormSet):
+    """
+    Validates each form's primary key against the objects the formset has
+    already fetched, instead of with a query per form
+    """
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+
+        pk_name = self._pk_field.name
+        pk_field = form.fields.get(pk_name)
+        if isinstance(pk_field, forms.ModelChoiceField):
+            shared_pk_field = SharedModelChoiceField(
+                queryset=pk_field.queryset,
+                initial=pk_field.initial,
+                required=pk_field.required,
+                widget=pk_field.widget,
+            )
+            if not hasattr(self, "_shared_pks"):
+                self._shared_pks = {obj.pk: obj for obj in self.get_queryset()}
+            shared_pk_field.shared_objects = self._shared_pks
+            form.fields[pk_name] = shared_pk_field
+
+
+class BaseHangerFormset(BaseSharedInlineFormSet):
+    """
+    Fetches the racks and articles that the forms can show once for the
+    whole formset, instead of once per form
+    """
+
+    def __init__(self, *args, queryset=None, **kwargs):
+        if queryset is None:
+            queryset = Hanger.objects.select_related("rack__section__page", "article")
+        super().__init__(*args, queryset=queryset, **kwargs)
+
+    def get_shared_objects(self, name, queryset):
+        # The selects only render their selected object, so only the
+        # objects of existing hangers and of submitted data are needed
+        if not hasattr(self, "_shared_objects"):
+            self._shared_objects = {}
+        if name not in self._shared_objects:
+            objects = {
+                getattr(hanger, name + "_id"): getattr(hanger, name)
+                for hanger in self.get_queryset()
+                if getattr(hanger, name + "_id") is not None
+            }
+            if self.is_bound:
+                ids = {
+                    int(value)
+                    for key, value in self.data.items()
+                    if key.startswith(self.prefix + "-")
+                    and key.endswith("-" + name)
+                    and value.isdigit()
+                } - set(objects)
+                if ids:
+                    objects.update(queryset.in_bulk(ids))
+            self._shared_objects[name] = objects
+
+        return self._shared_objects[name]
+
+    def share_choices(self, form):
+        field = form.fields.get("rack")
+        if isinstance(field, SharedModelChoiceField):
+            field.shared_objects = self.get_shared_objects(
+                "rack", Rack.objects.select_related("section__page")
+            )
+
+        field = form.fields.get("article")
+        if isinstance(field, SharedModelChoiceField):
+            field.shared_objects = self.get_shared_objects("article", field.queryset)
+
+        return form
+
+    def _construct_form(self, i, **kwargs):
+        return self.share_choices(super()._construct_form(i, **kwargs))
+
+    @property
+    def empty_form(self):
+        return self.share_choices(super().empty_form)
+
 
 class RackForm(ModelForm):
     class Meta:
@@ -135,6 +332,8 @@ class RackForm(ModelForm):
             "content_after_articles",
             "order",
             "display",
+            "max_items",
+            "defer",
         ]
         widgets = {
             "title": forms.TextInput(attrs={"class": "widthlong"}),
@@ -143,6 +342,13 @@ class RackForm(ModelForm):
             ),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sections are labelled with their page
+        self.fields["section"].queryset = self.fields[
+            "section"
+        ].queryset.select_related("page")
+
 
 class SectionForm(ModelForm):
     class Meta:
@@ -199,7 +405,15 @@ class ImijForm(forms.ModelForm):
         fields = ("imagefile", "name", "alt_text", "title")
 
 
-ArticleHangerFormset = inlineformset_factory(Article, Hanger, form=HangerForm, extra=10)
-RackHangerFormset = inlineformset_factory(Rack, Hanger, form=HangerForm, extra=10)
-PageSectionFormset = inlineformset_factory(Page, Section, form=SectionForm, extra=10)
-SectionRackFormset = inlineformset_factory(Section, Rack, form=RackForm, extra=10)
+ArticleHangerFormset = inlineformset_factory(
+    Article, Hanger, form=HangerForm, formset=BaseHangerFormset, extra=10
+)
+RackHangerFormset = inlineformset_factory(
+    Rack, Hanger, form=HangerForm, formset=BaseHangerFormset, extra=10
+)
+PageSectionFormset = inlineformset_factory(
+    Page, Section, form=SectionForm, formset=BaseSharedInlineFormSet, extra=10
+)
+SectionRackFormset = inlineformset_factory(
+    Section, Rack, form=RackForm, formset=BaseSharedInlineFormSet, extra=10
+)
@@ -0,0 +1,222 @@
+import io
+import logging
+import multiprocessing
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .caching import purge_instances
+from .models import Article, Imij
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = [320, 640, 1024, 1600]
+DEFAULT_SIZES = "(max-width: 600px) 90vw, 50vw"
+
+# The EXIF tag of the orientation the camera was held in
+ORIENTATION_TAG = 0x0112
+
+# The formats of the derivatives, as their Pillow format, extension and
+# content type, the preferred one first
+FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+
+def get_image_settings():
+    return settings.PYUSITE.get("IMAGES", {})
+
+
+def derivatives_enabled():
+    return bool(get_image_settings().get("ENABLED", False))
+
+
+def get_widths():
+    return sorted(get_image_settings().get("WIDTHS", DEFAULT_WIDTHS))
+
+
+def get_sizes():
+    return get_image_settings().get("SIZES", DEFAULT_SIZES)
+
+
+def get_display_size(imagefile):
+    """
+    The width and height of an image as it is displayed, with its EXIF
+    orientation applied, or (None, None) if Pillow is not installed or the
+    image cannot be read.  Only the header is read, not the whole image
+    """
+    if Image is None:
+        return None, None
+
+    close = imagefile.closed
+    try:
+        imagefile.open("rb")
+        position = imagefile.tell()
+        imagefile.seek(0)
+        try:
+            image = Image.open(imagefile.file)
+            width, height = image.size
+            orientation = image.getexif().get(ORIENTATION_TAG)
+        finally:
+            if close:
+                imagefile.close()
+            else:
+                imagefile.seek(position)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None, None
+
+    # The orientations that exif_transpose turns a quarter turn
+    if orientation in (5, 6, 7, 8):
+        return height, width
+
+    return width, height
+
+
+def get_derivative_name(name, width, extension):
+    directory, filename = posixpath.split(name)
+    return posixpath.join(
+        directory,
+        "derivatives",
+        "{}-{}w.{}".format(posixpath.splitext(filename)[0], width, extension),
+    )
+
+
+def make_derivatives(imagefile):
+    """
+    Saves copies of the image, resized to each of the configured widths
+    smaller than it, in each of the FORMATS.  Returns their names by format,
+    as lists of [width, name] from narrowest to widest, which are empty for
+    an image narrower than every width, and the size of the image as it is
+    displayed
+    """
+    storage = imagefile.storage
+    quality = get_image_settings().get("QUALITY", 80)
+
+    with imagefile.open("rb") as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.load()
+
+    derivatives = {format_name: [] for format_name in FORMATS}
+    for width in get_widths():
+        if width >= image.width:
+            break
+
+        resized = image.resize(
+            (width, max(1, round(image.height * width / image.width))),
+            Image.LANCZOS,
+        )
+        for format_name, (pillow_format, extension, content_type) in FORMATS.items():
+            if format_name == "jpeg" or resized.mode not in ("RGBA", "LA", "P"):
+                converted = resized.convert("RGB")
+            else:
+                converted = resized.convert("RGBA")
+
+            content = io.BytesIO()
+            converted.save(content, pillow_format, quality=quality)
+
+            name = get_derivative_name(imagefile.name, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, ContentFile(content.getvalue()))
+            derivatives[format_name].append([width, name])
+
+    # Kept even if empty, so that the image is not resized again for nothing
+    return derivatives, image.size
+
+
+def delete_derivatives(imij):
+    storage = imij.imagefile.storage
+    for names in (imij.derivatives or {}).values():
+        for width, name in names:
+            if storage.exists(name):
+                storage.delete(name)
+
+
+def invalidate_articles(imij):
+    """
+    Makes the articles that show the image render their markdown again, and
+    purges the cached pages that show them.  Their updated_datetime is
+    bumped too, since the validators of conditional GETs are built from it
+    """
+    url = imij.imagefile.url
+    articles = list(
+        Article.objects.filter(Q(content__contains=url) | Q(summary__contains=url))
+    )
+    if articles:
+        Article.objects.filter(pk__in=[article.pk for article in articles]).update(
+            rendered_hash="", updated_datetime=timezone.now()
+        )
+        purge_instances(articles)
+
+
+def generate_derivatives(pk):
+    """
+    Makes the derivatives of an Imij and stores their names on it.  Runs in
+    the worker processes.  Returns the number of files saved
+    """
+    imij = Imij.objects.get(pk=pk)
+    delete_derivatives(imij)
+
+    derivatives, (width, height) = make_derivatives(imij.imagefile)
+    # Also fills in the size of images that could not be measured when they
+    # were saved
+    Imij.objects.filter(pk=pk).update(
+        derivatives=derivatives, width=width, height=height
+    )
+    imij.derivatives = derivatives
+    invalidate_articles(imij)
+
+    return sum(len(names) for names in derivatives.values())
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        # Spawned rather than forked, so the workers do not share the
+        # database connections of the process handling the upload
+        _executor = ProcessPoolExecutor(
+            max_workers=get_image_settings().get("WORKERS", 2),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        )
+
+    return _executor
+
+
+def log_failure(future):
+    if future.exception() is not None:
+        logger.error(
+            "Could not make image derivatives", exc_info=future.exception()
+        )
+
+
+def queue_derivatives(pk):
+    """
+    Once the transaction commits, makes the derivatives of an Imij in the
+    background, if derivatives are enabled and Pillow is installed
+    """
+    if not derivatives_enabled():
+        return
+    if Image is None:
+        logger.warning("Pillow is not installed, so no image derivatives are made")
+        return
+
+    transaction.on_commit(
+        lambda: get_executor().submit(generate_derivatives, pk).add_done_callback(
+            log_failure
+        )
+    )
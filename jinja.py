@@ -0,0 +1,42 @@
+import posixpath
+import jinja2
+from django.templatetags.static import static
+from django.urls import reverse
+
+
+class Environment(jinja2.Environment):
+    """
+    Resolves template names starting with "./" relative to the template that
+    extends or includes them, as the Django template engine does, so both
+    themes can use the same names
+    """
+
+    def join_path(self, template, parent):
+        if template.startswith("./"):
+            return posixpath.join(posixpath.dirname(parent), template[2:])
+
+        return template
+
+
+def url(viewname, *args, **kwargs):
+    return reverse(viewname, args=args or None, kwargs=kwargs or None)
+
+
+def environment(**options):
+    """
+    The environment of the Jinja2 version of the public theme, for the
+    "environment" option of a Jinja2 engine in TEMPLATES
+    """
+    # Missing variables, and their attributes, render as nothing, as in
+    # Django templates, even when DEBUG would make them visible
+    options["undefined"] = jinja2.ChainableUndefined
+
+    env = Environment(**options)
+    env.globals.update(
+        {
+            "static": static,
+            "url": url,
+        }
+    )
+
+    return env
@@ -0,0 +1,365 @@
+from datetime import date, timedelta
+from django.db.models import F, Max, Min, Prefetch, Q, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
+from .caching import (
+    cache_entries,
+    get_cache,
+    get_entries,
+    get_purge_count,
+    get_timeout,
+    make_rack_key,
+    make_tag,
+    make_tree_key,
+    page_cache_enabled,
+)
+from .models import Hanger, Page, Rack, Section
+from .records import (
+    PageTree,
+    deferred_rack_to_record,
+    rack_to_record,
+    section_to_record,
+)
+
+HOME_PAGE_KEY = "pyusite:home_page"
+
+# The order of the hangers in a rack, which is also the key that rack pages
+# seek on
+HANGER_ORDERING = ("order", "-article__publish_date", "pk")
+
+
+def get_home_page_pk():
+    """
+    The pk of the home page, or None if there isn't one, cached until a page
+    becomes or stops being the home page
+    """
+    home_page = get_cache().get(HOME_PAGE_KEY)
+    if home_page is None:
+        home_page = {
+            "pk": Page.objects.filter(is_home=True)
+            .values_list("pk", flat=True)
+            .first()
+        }
+        get_cache().set(HOME_PAGE_KEY, home_page, None)
+
+    return home_page["pk"]
+
+
+def invalidate_home_page():
+    get_cache().delete(HOME_PAGE_KEY)
+
+
+def get_visible_hangers(today=None):
+    """
+    Hangers whose articles should be displayed today, with the article and
+    everything the templates read from it
+    """
+    if today is None:
+        today = date.today()
+
+    return (
+        Hanger.objects.filter(
+            article__display="Y",
+            article__publish_date__lte=today,
+        )
+        .filter(Q(expiration_date__isnull=True) | Q(expiration_date__gt=today))
+        .select_related("article", "article__author", "article__iframe_document")
+    )
+
+
+def get_rack_hangers(today=None):
+    """
+    The visible hangers in rack order, limited to the first max_items of
+    each rack that has max_items, plus one more to tell whether the rack has
+    more hangers than it shows
+    """
+    return (
+        get_visible_hangers(today)
+        .annotate(
+            row_number=Window(
+                RowNumber(), partition_by=F("rack_id"), order_by=HANGER_ORDERING
+            ),
+            rack_max_items=F("rack__max_items"),
+        )
+        .filter(
+            Q(rack_max_items__isnull=True) | Q(row_number__lte=F("rack_max_items") + 1)
+        )
+        .order_by(*HANGER_ORDERING)
+    )
+
+
+def make_rack_cursor(hanger):
+    return "{}.{}.{}".format(
+        hanger.order, hanger.article.publish_date.isoformat(), hanger.pk
+    )
+
+
+def get_hangers_after(hangers, cursor):
+    """
+    Filters hangers to those that come after the hanger the cursor was made
+    from, by seeking on the rack order rather than counting an offset, so that
+    deep rack pages cost the same as the first.  Raises ValueError if the
+    cursor is malformed
+    """
+    order, publish_date, pk = cursor.split(".")
+    order, publish_date, pk = int(order), date.fromisoformat(publish_date), int(pk)
+
+    return hangers.filter(
+        Q(order__gt=order)
+        | Q(order=order, article__publish_date__lt=publish_date)
+        | Q(order=order, article__publish_date=publish_date, pk__gt=pk)
+    )
+
+
+def get_page_sections(page):
+    """
+    The sections of a page with their racks.  The racks' hangers are loaded
+    by load_racks, which skips the racks that are cached
+    """
+    return Section.objects.filter(page=page).prefetch_related("rack_set")
+
+
+def get_page_structure_tags(page):
+    """
+    The tags of a page, its sections and their racks, known before the
+    page's articles are loaded.  Since saving a hanger or an article purges
+    its rack's tag, they are enough to purge the page
+    """
+    tags = {make_tag("page", page.pk)}
+    for section_pk, rack_pk in Section.objects.filter(page=page).values_list(
+        "pk", "rack__pk"
+    ):
+        tags.add(make_tag("section", section_pk))
+        if rack_pk is not None:
+            tags.add(make_tag("rack", rack_pk))
+
+    return tags
+
+
+def get_next_visibility_transition(hangers, today=None):
+    """
+    The earliest date after today on which one of the hangers' articles is
+    due to be published or one of the hangers is due to expire, or None if
+    there is no such date
+    """
+    if today is None:
+        today = date.today()
+
+    dates = hangers.filter(article__display="Y").aggregate(
+        next_publish_date=Min(
+            "article__publish_date", filter=Q(article__publish_date__gt=today)
+        ),
+        next_expiration_date=Min(
+            "expiration_date", filter=Q(expiration_date__gt=today)
+        ),
+    )
+    dates = [value for value in dates.values() if value is not None]
+
+    return min(dates) if dates else None
+
+
+def get_page_visibility_transition(page, today=None):
+    return get_next_visibility_transition(
+        Hanger.objects.filter(rack__section__page=page), today
+    )
+
+
+def get_rack_visibility_transition(rack, today=None):
+    return get_next_visibility_transition(
+        Hanger.objects.filter(rack=rack), today
+    )
+
+
+def get_content_modified(hangers):
+    """
+    When the latest of the hangers' articles was last updated, or None if
+    there are no hangers
+    """
+    return hangers.aggregate(modified=Max("article__updated_datetime"))["modified"]
+
+
+def get_page_content_modified(page):
+    return get_content_modified(Hanger.objects.filter(rack__section__page=page))
+
+
+def get_rack_content_modified(rack):
+    return get_content_modified(Hanger.objects.filter(rack=rack))
+
+
+def make_rack_record(rack, hangers=None, authors=None):
+    """
+    A rack's record for the templates, with at most max_items of the hangers
+    (by default its prefetched hangers) and, if there are more, the cursor
+    of the page of the rack that follows
+    """
+    if hangers is None:
+        hangers = rack.hanger_set.all()
+    hangers = list(hangers)
+
+    next_cursor = None
+    if rack.max_items is not None and len(hangers) > rack.max_items:
+        hangers = hangers[: rack.max_items]
+        next_cursor = make_rack_cursor(hangers[-1]) if hangers else None
+
+    return rack_to_record(rack, hangers, next_cursor, authors)
+
+
+def get_rack_tags(rack):
+    """
+    The tags of a rack.  Its hangers and articles are not tagged one by one,
+    since saving or deleting any of them purges the rack's tag, which keeps
+    the number of tag versions checked small however many articles a page
+    shows
+    """
+    return {make_tag("rack", rack.pk)}
+
+
+def load_racks(racks, today=None, tags=None, purge_count=None):
+    """
+    Returns a dict, by pk, of the racks as records for the templates,
+    with their visible hangers.  Racks are cached individually until the end
+    of the day or until something they include is saved, and the hangers of
+    all the racks that are not cached are fetched in a single query, so the
+    racks must not have their hangers prefetched already.  If a set is
+    passed as tags, the cache tags of the racks are added to it.  A caller
+    that loaded the racks itself passes the purge count it read before
+    """
+    if today is None:
+        today = date.today()
+
+    racks = list(racks)
+    use_cache = page_cache_enabled()
+    keys = {rack.pk: make_rack_key(rack.pk) for rack in racks}
+    cached = {}
+    if use_cache:
+        if purge_count is None:
+            purge_count = get_purge_count()
+        cached = get_entries(keys.values())
+
+    rack_records = {}
+    missing = []
+    for rack in racks:
+        entry = cached.get(keys[rack.pk])
+        if entry is None:
+            missing.append(rack)
+        else:
+            rack_records[rack.pk] = entry["rack"]
+            if tags is not None:
+                tags.update(entry["tags"])
+
+    if missing:
+        prefetch_related_objects(
+            missing, Prefetch("hanger_set", queryset=get_rack_hangers(today))
+        )
+
+        entries = {}
+        authors = {}
+        for rack in missing:
+            entry = {
+                "rack": make_rack_record(rack, authors=authors),
+                "tags": frozenset(get_rack_tags(rack)),
+            }
+            rack_records[rack.pk] = entry["rack"]
+            entries[keys[rack.pk]] = entry
+            if tags is not None:
+                tags.update(entry["tags"])
+
+        if use_cache:
+            # Visibility only changes from one day to the next
+            cache_entries(
+                entries, get_timeout(today + timedelta(days=1)), purge_count
+            )
+
+    return rack_records
+
+
+def load_rack_page(rack, cursor, today=None, tags=None):
+    """
+    Returns, as a record for the templates, the page of a rack's visible
+    hangers that follows the cursor.  Raises ValueError if the cursor is
+    malformed
+    """
+    hangers = get_hangers_after(
+        get_visible_hangers(today).filter(rack=rack).order_by(*HANGER_ORDERING),
+        cursor,
+    )
+    if rack.max_items is not None:
+        hangers = hangers[: rack.max_items + 1]
+    hangers = list(hangers)
+
+    if tags is not None:
+        tags.update(get_rack_tags(rack))
+
+    return make_rack_record(rack, hangers)
+
+
+def build_page_tree(page, today=None, purge_count=None):
+    """
+    The sections of a page as a PageTree for the templates.  Racks without
+    visible hangers are left out, as are sections without racks unless the
+    section is set not to collapse.  Deferred racks are only placeholders,
+    which are kept whether or not the racks have visible hangers
+    """
+    if purge_count is None and page_cache_enabled():
+        purge_count = get_purge_count()
+
+    sections = []
+    special_sections = []
+    tags = {make_tag("page", page.pk)}
+
+    page_sections = list(get_page_sections(page))
+    rack_records = load_racks(
+        [
+            rack
+            for section in page_sections
+            for rack in section.rack_set.all()
+            if not rack.defer
+        ],
+        today,
+        tags,
+        purge_count,
+    )
+
+    for section in page_sections:
+        tags.add(make_tag("section", section.pk))
+
+        racks = []
+        for rack in section.rack_set.all():
+            if rack.defer:
+                # Only a placeholder, which the browser replaces with the
+                # rack's fragment
+                tags.add(make_tag("rack", rack.pk))
+                racks.append(deferred_rack_to_record(rack))
+            elif rack_records[rack.pk].hangers:
+                racks.append(rack_records[rack.pk])
+
+        if racks or section.collapse == False:
+            if section.is_special:
+                special_sections.append(section_to_record(section, racks))
+            else:
+                sections.append(section_to_record(section, racks))
+
+    return PageTree(tuple(sections), tuple(special_sections), frozenset(tags))
+
+
+def load_page_tree(page, today=None):
+    """
+    The PageTree of a page, built once and then shared from the cache until
+    the end of the day or until something in it is saved
+    """
+    if today is None:
+        today = date.today()
+
+    if not page_cache_enabled():
+        return build_page_tree(page, today)
+
+    key = make_tree_key(page.pk)
+    entry = get_entries([key]).get(key)
+    if entry is None:
+        purge_count = get_purge_count()
+        tree = build_page_tree(page, today, purge_count)
+        entry = {"tree": tree, "tags": tree.tags}
+        cache_entries(
+            {key: entry}, get_timeout(today + timedelta(days=1)), purge_count
+        )
+
+    return entry["tree"]
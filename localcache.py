@@ -0,0 +1,158 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+MISSING = object()
+
+
+class LocalCache:
+    """
+    An in-process least recently used cache, bounded by the total pickled
+    size of its values.  Values are shared, not copied, so they must not be
+    changed after they are cached.  Thread safe
+    """
+
+    def __init__(self, max_bytes, timeout):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+
+            value, size, expires = entry
+            if expires < time.monotonic():
+                self._delete(key)
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        # timeout is that of the entry in the shared cache, which local
+        # entries never outlive
+        if timeout is not None and timeout is not DEFAULT_TIMEOUT:
+            timeout = min(timeout, self.timeout)
+        else:
+            timeout = self.timeout
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+
+        with self.lock:
+            self._delete(key)
+            self.entries[key] = (value, size, time.monotonic() + timeout)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._delete(next(iter(self.entries)))
+
+    def delete(self, key):
+        with self.lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def sync(self, generation):
+        """
+        Empties the cache if the content has changed since it was filled, as
+        told by a generation number that every change increases
+        """
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+
+class TieredCache:
+    """
+    A LocalCache (L1) in front of a Django cache (L2).  Reads are answered
+    from L1 when possible and fill it from L2, and writes and deletes go to
+    both.  Keys starting with one of shared_prefixes, such as those that are
+    read, changed and written back, are only kept in L2
+    """
+
+    def __init__(self, shared, local, shared_prefixes=()):
+        self.shared = shared
+        self.local = local
+        self.shared_prefixes = tuple(shared_prefixes)
+
+    def is_local(self, key):
+        return not key.startswith(self.shared_prefixes)
+
+    def get(self, key, default=None):
+        if self.is_local(key):
+            value = self.local.get(key)
+            if value is not MISSING:
+                return value
+
+        value = self.shared.get(key, MISSING)
+        if value is MISSING:
+            return default
+        if self.is_local(key):
+            self.local.set(key, value)
+
+        return value
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = {}
+        for key in keys:
+            if self.is_local(key):
+                value = self.local.get(key)
+                if value is not MISSING:
+                    values[key] = value
+
+        missing = [key for key in keys if key not in values]
+        if missing:
+            shared_values = self.shared.get_many(missing)
+            for key, value in shared_values.items():
+                if self.is_local(key):
+                    self.local.set(key, value)
+            values.update(shared_values)
+
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self.shared.set(key, value, timeout)
+        if self.is_local(key):
+            self.local.set(key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT):
+        self.shared.set_many(data, timeout)
+        for key, value in data.items():
+            if self.is_local(key):
+                self.local.set(key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self.local.delete(key)
+        return self.shared.add(key, value, timeout)
+
+    def delete(self, key):
+        self.local.delete(key)
+        return self.shared.delete(key)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        for key in keys:
+            self.local.delete(key)
+        self.shared.delete_many(keys)
+
+    def incr(self, key, delta=1):
+        self.local.delete(key)
+        return self.shared.incr(key, delta)
@@ -0,0 +1,250 @@
+import gc
+import pickle
+import time
+import tracemalloc
+from datetime import date, timedelta
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+from pyusite.loaders import build_page_tree, get_visible_hangers
+from pyusite.models import Article, Hanger, Page, Rack, Section
+from pyusite.rendering import get_renderer_version, get_source_hash, render_markdown
+from pyusite.views import PageView
+from pyusite.warming import get_default_host
+
+
+class Command(BaseCommand):
+    help = "Seed a temporary dataset and benchmark pyusite against it.  The dataset is rolled back when the command finishes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "benchmark",
+            choices=["plans", "memory", "render"],
+            help="plans: print the query plans of the queries used to render a page.  memory: compare the size of a page tree held as records with the same tree held as nested dicts.  render: time rendering a page with the Django and the Jinja2 versions of the theme",
+        )
+        parser.add_argument(
+            "--articles",
+            type=int,
+            default=100000,
+            help="The number of articles to seed",
+        )
+        parser.add_argument(
+            "--sections",
+            type=int,
+            default=6,
+            help="The number of sections on the seeded page",
+        )
+        parser.add_argument(
+            "--racks",
+            type=int,
+            default=20,
+            help="The number of racks spread across the sections of the seeded page",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="The number of times each theme renders the page in the render benchmark",
+        )
+        parser.add_argument(
+            "--django-engine",
+            default="django",
+            help="The alias in TEMPLATES of the Django template engine",
+        )
+        parser.add_argument(
+            "--jinja2-engine",
+            default="jinja2",
+            help="The alias in TEMPLATES of the Jinja2 engine using pyusite.jinja.environment",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="The number of rows inserted per query while seeding",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+
+        with transaction.atomic():
+            page = self.seed()
+            self.analyze()
+            getattr(self, "benchmark_{}".format(options["benchmark"]))(page)
+            transaction.set_rollback(True)
+
+    def seed(self):
+        options = self.options
+        today = date.today()
+
+        page = Page.objects.create(slug="pyusite-benchmark", title="Benchmark")
+        sections = Section.objects.bulk_create(
+            Section(page=page, slug="pyusite-benchmark-{}".format(i), order=i)
+            for i in range(options["sections"])
+        )
+        racks = Rack.objects.bulk_create(
+            Rack(
+                section=sections[i % len(sections)],
+                slug="pyusite-benchmark-{}".format(i),
+                order=i,
+            )
+            for i in range(options["racks"])
+        )
+
+        # Every article has the same markdown apart from its number, so it is
+        # rendered once rather than for each article
+        content = "Benchmark article {}\n\n*content*"
+        content_html = render_markdown(content)
+        renderer_version = get_renderer_version()
+
+        for start in range(0, options["articles"], options["batch_size"]):
+            stop = min(start + options["batch_size"], options["articles"])
+            articles = Article.objects.bulk_create(
+                Article(
+                    title="Benchmark article {}".format(i),
+                    slug="pyusite-benchmark-{}".format(i),
+                    content=content.format(i),
+                    content_html=content_html.format(i),
+                    rendered_hash=get_source_hash(content.format(i), ""),
+                    rendered_version=renderer_version,
+                    display="YYYYYYYPN"[i % 9],
+                    publish_date=today - timedelta(days=(i % 1000) - 30),
+                )
+                for i in range(start, stop)
+            )
+            Hanger.objects.bulk_create(
+                Hanger(
+                    rack=racks[i % len(racks)],
+                    article=article,
+                    order=i % 10,
+                    expiration_date=(
+                        today + timedelta(days=(i % 60) - 30) if i % 4 == 0 else None
+                    ),
+                )
+                for i, article in enumerate(articles, start)
+            )
+
+        self.stdout.write(
+            "Seeded {} articles in {} racks".format(options["articles"], len(racks))
+        )
+
+        return page
+
+    def analyze(self):
+        if connection.vendor in ("postgresql", "sqlite"):
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+    def benchmark_plans(self, page):
+        racks = list(Rack.objects.filter(section__page=page))
+
+        querysets = {
+            "home page": Page.objects.filter(is_home=True)[:1],
+            "sections of a page": Section.objects.filter(page=page),
+            "racks of a page": Rack.objects.filter(section__page=page),
+            "visible hangers of a page": get_visible_hangers().filter(
+                rack__in=racks
+            ),
+            "latest visible articles": Article.objects.filter(
+                display="Y", publish_date__lte=date.today()
+            )[:20],
+        }
+
+        for label, queryset in querysets.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain())
+            self.stdout.write("")
+
+    def benchmark_memory(self, page):
+        # Built without the page cache, whose entries would outlive the
+        # rolled back dataset
+        with override_settings(PYUSITE=dict(settings.PYUSITE, PAGE_CACHE={})):
+            start = time.perf_counter()
+            tree = build_page_tree(page)
+            build_seconds = time.perf_counter() - start
+
+        hangers = sum(
+            len(rack.hangers)
+            for section in tree.sections + tree.special_sections
+            for rack in section.racks
+        )
+        self.stdout.write(
+            "Built a tree of {} hangers in {:.0f} ms".format(
+                hangers, build_seconds * 1000
+            )
+        )
+
+        for label, value in (("records", tree), ("dicts", to_dicts(tree))):
+            # Measured as they are after being read from the cache
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            del value
+            gc.collect()
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            loaded = pickle.loads(pickled)
+            load_seconds = time.perf_counter() - start
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del loaded
+
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(
+                "  in memory {:>12,} bytes\n  pickled   {:>12,} bytes\n  unpickled in {:.0f} ms".format(
+                    retained, len(pickled), load_seconds * 1000
+                )
+            )
+
+    def benchmark_render(self, page):
+        engines = [self.options["django_engine"], self.options["jinja2_engine"]]
+        host = get_default_host()
+        # Rendered without the page cache, whose entries would outlive the
+        # rolled back dataset, and without streaming
+        uncached = dict(settings.PYUSITE, PAGE_CACHE={}, STREAM_PAGES=False)
+
+        request = RequestFactory(HTTP_HOST=host).get(
+            reverse("pyusite:page", kwargs={"pk": page.pk})
+        )
+        request.user = AnonymousUser()
+        view = PageView()
+        view.setup(request, pk=page.pk)
+        view.object = page
+        view.cache_tags = set()
+        with override_settings(PYUSITE=uncached):
+            context = view.get_context_data(object=page)
+
+        for engine in engines:
+            seconds = []
+            for i in range(self.options["repeat"]):
+                start = time.perf_counter()
+                render_to_string(
+                    view.get_template_names(), context, request, using=engine
+                )
+                seconds.append(time.perf_counter() - start)
+
+            self.stdout.write(
+                "{:<10} best {:.0f} ms, mean {:.0f} ms".format(
+                    engine,
+                    min(seconds) * 1000,
+                    sum(seconds) / len(seconds) * 1000,
+                )
+            )
+
+
+def to_dicts(value):
+    """
+    A tree of records as the nested dicts and lists that pages used to be
+    built from
+    """
+    if hasattr(value, "_asdict"):
+        return {key: to_dicts(item) for key, item in value._asdict().items()}
+    if isinstance(value, (tuple, list)):
+        return [to_dicts(item) for item in value]
+
+    return value
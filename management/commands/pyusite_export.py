@@ -0,0 +1,358 @@
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.urls import reverse
+from pyusite.caching import (
+    PARENT_FIELDS,
+    STRUCTURE_MODELS,
+    get_site_config_version,
+    get_structure_versions,
+    make_tag,
+)
+from pyusite.loaders import HANGER_ORDERING, get_visible_hangers, make_rack_cursor
+from pyusite.models import Article, Hanger, Page, Rack
+from pyusite.rendering import get_renderer_version
+from pyusite.warming import get_default_host, render_url
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = "pyusite-manifest.json"
+
+
+def get_export_path(output_dir, url):
+    return os.path.join(output_dir, url.strip("/"), "index.html")
+
+
+def write_file(path, content):
+    # Written beside the file and moved into place, so the web server never
+    # serves half a file
+    temporary_path = "{}.tmp{}".format(path, os.getpid())
+    with open(temporary_path, "wb") as f:
+        f.write(content)
+    os.replace(temporary_path, path)
+
+
+def write_export(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_file(path, content)
+    write_file(path + ".gz", gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_file(path + ".br", brotli.compress(content))
+
+
+def get_export_version():
+    # Everything is rendered again when the settings or the renderer change
+    return "{}:{}".format(get_site_config_version(), get_renderer_version())
+
+
+def get_changed_models(since):
+    """
+    The names of the tags of every object that may have changed since the
+    timestamp: those of the structure models changed since then and of their
+    parents.  Since those models have no modification dates, only the time
+    of the last change to any of their rows is known
+    """
+    names = set()
+    for model_name, version in get_structure_versions(STRUCTURE_MODELS).items():
+        if version >= since:
+            names.add(model_name)
+            names.update(PARENT_FIELDS.get(model_name, []))
+            if model_name == "menu":
+                names.add("main_menus")
+
+    return names
+
+
+def get_changed_tags(since, today):
+    """
+    The tags of the articles updated since the timestamp and of their racks,
+    and of the racks whose hangers were due to be published or to expire
+    since then
+    """
+    since_date = date.fromtimestamp(since)
+    tags = set()
+
+    article_pks = list(
+        Article.objects.filter(
+            updated_datetime__gte=datetime.fromtimestamp(
+                since, timezone.utc if settings.USE_TZ else None
+            )
+        ).values_list("pk", flat=True)
+    )
+    for pk in article_pks:
+        tags.add(make_tag("article", pk))
+
+    for rack_id, article_id in Hanger.objects.filter(
+        Q(article__in=article_pks)
+        | Q(article__publish_date__gt=since_date, article__publish_date__lte=today)
+        | Q(expiration_date__gt=since_date, expiration_date__lte=today)
+    ).values_list("rack_id", "article_id"):
+        if rack_id is not None:
+            tags.add(make_tag("rack", rack_id))
+        if article_id is not None:
+            tags.add(make_tag("article", article_id))
+
+    return tags
+
+
+def export_url(url, previous, output_dir, host):
+    """
+    Renders a url through the site's views and writes it below output_dir.
+    Runs in the worker processes.  Returns the url's new manifest entry, or
+    None if the url could not be rendered
+    """
+    headers = {}
+    if previous.get("etag"):
+        headers["HTTP_IF_NONE_MATCH"] = previous["etag"]
+
+    response = render_url(url, host, **headers)
+    path = get_export_path(output_dir, url)
+
+    if response.status_code == 304 and os.path.exists(path):
+        return dict(previous, status="unchanged")
+    if response.status_code != 200:
+        return None
+
+    content = response.getvalue()
+    content_hash = hashlib.sha256(content).hexdigest()
+    status = "unchanged"
+    if content_hash != previous.get("hash") or not os.path.exists(path):
+        write_export(path, content)
+        status = "written"
+
+    return {
+        "hash": content_hash,
+        "etag": response.get("ETag"),
+        "tags": sorted(getattr(response, "pyusite_cache_tags", ())),
+        "status": status,
+    }
+
+
+def export_batch(urls, previous_entries, output_dir, host):
+    return {
+        url: export_url(url, previous_entries.get(url, {}), output_dir, host)
+        for url in urls
+    }
+
+
+class Command(BaseCommand):
+    help = "Export the public pages, articles and racks to static html files, with gzip and, if the brotli package is installed, brotli copies, for a web server to serve without Django.  Only urls that include something changed since the last export are rendered again, and only those whose content changed are rewritten"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output_dir",
+            help="The directory to export to",
+        )
+        parser.add_argument(
+            "--host",
+            default=None,
+            help="The host name to render the pages for.  Defaults to the first of ALLOWED_HOSTS",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="The number of processes rendering pages",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=20,
+            help="The number of urls each process renders at a time",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Render every url again, even those that have not changed",
+        )
+
+    def handle(self, *args, **options):
+        output_dir = os.path.abspath(options["output_dir"])
+        host = options["host"] or get_default_host()
+        manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        # The versions of the structure models that are not cached yet are
+        # set to now before the export starts, so that only this export
+        # takes them to have changed.  Changes made while exporting are
+        # picked up by the next export
+        get_structure_versions(STRUCTURE_MODELS)
+        started = time.time()
+        today = date.today()
+
+        manifest = {"urls": {}}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        previous_entries = manifest["urls"]
+        # Without previous entries, every url is rendered and written again
+        known_entries = {} if options["force"] else previous_entries
+
+        if brotli is None:
+            self.stderr.write("brotli is not installed, so no .br files are written")
+
+        article_pks = list(self.get_articles().values_list("pk", flat=True))
+        urls = self.get_urls()
+        to_render = self.get_urls_to_render(
+            urls, known_entries, manifest, article_pks, output_dir, today
+        )
+        batches = [
+            to_render[start : start + options["batch_size"]]
+            for start in range(0, len(to_render), options["batch_size"])
+        ]
+
+        entries = {
+            url: dict(known_entries[url], status="skipped")
+            for url in urls
+            if url not in to_render
+        }
+        # Spawned rather than forked, so the workers do not share the
+        # database connections of this process, and set up Django themselves
+        # as they would under any start method
+        with ProcessPoolExecutor(
+            max_workers=options["workers"],
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        ) as executor:
+            futures = [
+                executor.submit(
+                    export_batch,
+                    batch,
+                    {url: known_entries[url] for url in batch if url in known_entries},
+                    output_dir,
+                    host,
+                )
+                for batch in batches
+            ]
+            for future in futures:
+                entries.update(future.result())
+
+        failed = [url for url, entry in entries.items() if entry is None]
+        entries = {url: entry for url, entry in entries.items() if entry is not None}
+
+        removed = [url for url in previous_entries if url not in entries]
+        for url in removed:
+            path = get_export_path(output_dir, url)
+            for suffix in ("", ".gz", ".br"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+        written = [url for url, entry in entries.items() if entry["status"] == "written"]
+        skipped = [url for url, entry in entries.items() if entry["status"] == "skipped"]
+        for entry in entries.values():
+            del entry["status"]
+
+        os.makedirs(output_dir, exist_ok=True)
+        write_file(
+            manifest_path,
+            json.dumps(
+                {
+                    "exported": today.isoformat(),
+                    "exported_at": started,
+                    "version": get_export_version(),
+                    "articles": article_pks,
+                    "urls": entries,
+                },
+                indent=1,
+                sort_keys=True,
+            ).encode(),
+        )
+
+        for url in failed:
+            self.stderr.write("Could not render {}".format(url))
+        self.stdout.write(
+            "Exported {} urls: {} written, {} unchanged, {} skipped, {} removed, {} failed".format(
+                len(urls),
+                len(written),
+                len(entries) - len(written) - len(skipped),
+                len(skipped),
+                len(removed),
+                len(failed),
+            )
+        )
+
+    def get_urls_to_render(
+        self, urls, known_entries, manifest, article_pks, output_dir, today
+    ):
+        """
+        The urls that are new, or whose files are missing, or that include
+        anything that may have changed since the last export, going by the
+        tags recorded for them
+        """
+        since = manifest.get("exported_at")
+        if (
+            not known_entries
+            or since is None
+            or manifest.get("version") != get_export_version()
+        ):
+            return urls
+
+        changed_models = get_changed_models(since)
+        changed_tags = get_changed_tags(since, today)
+        # Deleting an article leaves no trace in its racks, so if a
+        # published article is gone, every rack is rendered again
+        if set(manifest.get("articles", [])) - set(article_pks):
+            changed_models.add("rack")
+
+        return [
+            url
+            for url in urls
+            if url not in known_entries
+            or "tags" not in known_entries[url]
+            or not os.path.exists(get_export_path(output_dir, url))
+            or any(
+                tag in changed_tags or tag.partition(":")[0] in changed_models
+                for tag in known_entries[url]["tags"]
+            )
+        ]
+
+    def get_articles(self):
+        return Article.objects.filter(display="Y", publish_date__lte=date.today())
+
+    def get_urls(self):
+        urls = [reverse("pyusite:home"), reverse("pyusite:homepage")]
+
+        for pk, slug in Page.objects.filter(display="Y").values_list("pk", "slug"):
+            urls.append(reverse("pyusite:page", kwargs={"pk": pk}))
+            urls.append(reverse("pyusite:page", kwargs={"slug": slug}))
+
+        for pk, slug in self.get_articles().values_list("pk", "slug"):
+            urls.append(reverse("pyusite:article", kwargs={"pk": pk}))
+            urls.append(reverse("pyusite:article", kwargs={"slug": slug}))
+
+        for rack in Rack.objects.exclude(display="N"):
+            urls.append(reverse("pyusite:rack", kwargs={"pk": rack.pk}))
+            urls.append(reverse("pyusite:rack", kwargs={"slug": rack.slug}))
+            if rack.defer:
+                urls.append(reverse("pyusite:rack-fragment", kwargs={"pk": rack.pk}))
+            if rack.max_items:
+                urls.extend(self.get_rack_page_urls(rack))
+
+        return list(dict.fromkeys(urls))
+
+    def get_rack_page_urls(self, rack):
+        # The pages that follow the first, each starting after the last
+        # hanger of the one before
+        hangers = list(
+            get_visible_hangers()
+            .filter(rack=rack)
+            .order_by(*HANGER_ORDERING)
+        )
+
+        return [
+            reverse(
+                "pyusite:rack-after",
+                kwargs={"pk": rack.pk, "after": make_rack_cursor(hanger)},
+            )
+            for hanger in hangers[rack.max_items - 1 : -1 : rack.max_items]
+        ]
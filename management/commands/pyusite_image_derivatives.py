@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from pyusite import images
+from pyusite.models import Imij
+
+
+class Command(BaseCommand):
+    help = "Make the resized WebP and JPEG copies of the images that do not have them yet, such as those uploaded before IMAGES was enabled"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Make the copies of every image again, even those that have them",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="The number of processes resizing images",
+        )
+
+    def handle(self, *args, **options):
+        if images.Image is None:
+            raise CommandError("Pillow is not installed")
+
+        imijs = Imij.objects.order_by("pk")
+        if not options["force"]:
+            # Images narrower than every width have empty lists of copies
+            imijs = imijs.filter(Q(derivatives={}) | Q(width__isnull=True))
+        pks = list(imijs.values_list("pk", flat=True))
+
+        saved_count = 0
+        failed = []
+        # Spawned rather than forked, so the workers do not share the
+        # database connections of this process, and set up Django themselves
+        # as they would under any start method
+        with ProcessPoolExecutor(
+            max_workers=options["workers"],
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        ) as executor:
+            futures = {
+                pk: executor.submit(images.generate_derivatives, pk) for pk in pks
+            }
+            for pk, future in futures.items():
+                try:
+                    saved_count += future.result()
+                except Exception as e:
+                    failed.append(pk)
+                    self.stderr.write("Could not resize image {}: {}".format(pk, e))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Saved {} file(s) for {} image(s), {} failed".format(
+                    saved_count, len(pks) - len(failed), len(failed)
+                )
+            )
+        )
@@ -0,0 +1,56 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from django.core.management.base import BaseCommand
+from pyusite.purge import TAG_HEADER_SEPARATORS
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for a CDN or reverse proxy that prints the tag purges it receives, to try out EDGE_CACHE purging offline"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--address",
+            default="127.0.0.1",
+            help="The address to listen on",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=6081,
+            help="The port to listen on",
+        )
+
+    def handle(self, *args, **options):
+        command = self
+
+        class PurgeHandler(BaseHTTPRequestHandler):
+            def do_PURGE(self):
+                tags = []
+                for header, separator in TAG_HEADER_SEPARATORS.items():
+                    for value in self.headers.get_all(header) or []:
+                        tags.extend(tag for tag in value.split(separator) if tag)
+
+                command.stdout.write(
+                    "{} {} {}".format(self.command, self.path, " ".join(sorted(tags)))
+                )
+
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            do_POST = do_PURGE
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer((options["address"], options["port"]), PurgeHandler)
+        self.stdout.write(
+            "Listening for purges on http://{}:{}/".format(
+                options["address"], options["port"]
+            )
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from pyusite.models import Article
+
+
+class Command(BaseCommand):
+    help = "Render article content and summary from markdown to html and store the result"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-render every article, even if its stored html is current",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="The number of articles written per query",
+        )
+
+    def handle(self, *args, **options):
+        articles = Article.objects.only(
+            "pk", "content", "summary", *Article.rendered_fields
+        ).order_by("pk")
+
+        batch = []
+        rendered_count = 0
+        for article in articles.iterator(chunk_size=options["batch_size"]):
+            if article.render(force=options["force"]):
+                batch.append(article)
+
+            if len(batch) >= options["batch_size"]:
+                Article.objects.bulk_update(batch, Article.rendered_fields)
+                rendered_count += len(batch)
+                batch = []
+
+        if batch:
+            Article.objects.bulk_update(batch, Article.rendered_fields)
+            rendered_count += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS("Rendered {} article(s)".format(rendered_count))
+        )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from pyusite.warming import get_warm_urls, warm
+
+
+class Command(BaseCommand):
+    help = "Render the home page, the pages in the main menus and then the other pages as an anonymous visitor, to fill the page cache after a deploy or a bulk edit, and report the time and queries each url took"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "urls",
+            nargs="*",
+            help="The urls to warm, instead of every page",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="The number of urls rendered at once",
+        )
+        parser.add_argument(
+            "--host",
+            default=None,
+            help="The host name to render the pages for.  Defaults to the first of ALLOWED_HOSTS",
+        )
+        parser.add_argument(
+            "--articles",
+            action="store_true",
+            help="Also warm every published article",
+        )
+
+    def handle(self, *args, **options):
+        urls = options["urls"] or get_warm_urls(options["articles"])
+
+        results = warm(urls, options["concurrency"], options["host"])
+
+        for result in results:
+            line = "{status} {milliseconds:8.1f} ms {queries:4} queries  {url}".format(
+                milliseconds=result["seconds"] * 1000, **result
+            )
+            if result["status"] == 200:
+                self.stdout.write(line)
+            else:
+                self.stdout.write(self.style.ERROR(line))
+
+        self.stdout.write(
+            "Warmed {} urls in {:.1f} ms of rendering with {} queries".format(
+                len(results),
+                sum(result["seconds"] for result in results) * 1000,
+                sum(result["queries"] for result in results),
+            )
+        )
@@ -0,0 +1,65 @@
+from collections import defaultdict
+from .caching import get_cache
+from .models import Menu, Menuitem, MenuPage
+
+MENUS_KEY = "pyusite:menus"
+
+# Menus with a level of at least this are shown as the site menu
+MAIN_MENU_LEVEL = 1000
+
+
+def build_menus():
+    """
+    Builds every menu with its items, and the menus attached to each page, as
+    plain data that can be cached and handed to the templates
+    """
+    menuitems = defaultdict(list)
+    for menuitem in Menuitem.objects.exclude(menu=None):
+        menuitems[menuitem.menu_id].append(
+            {"pk": menuitem.pk, "href": menuitem.href, "label": menuitem.label}
+        )
+
+    menus = {}
+    main_menus = []
+    for menu in Menu.objects.all():
+        menus[menu.pk] = {
+            "pk": menu.pk,
+            "name": menu.name,
+            "level": menu.level,
+            "menuitems": menuitems[menu.pk],
+        }
+        if menu.level >= MAIN_MENU_LEVEL:
+            main_menus.append(menu.pk)
+
+    page_menus = defaultdict(list)
+    for page_id, menu_id in MenuPage.objects.values_list("page_id", "menu_id"):
+        page_menus[page_id].append(menu_id)
+
+    return {"menus": menus, "main_menus": main_menus, "page_menus": dict(page_menus)}
+
+
+def get_menus():
+    registry = get_cache().get(MENUS_KEY)
+    if registry is None:
+        registry = build_menus()
+        get_cache().set(MENUS_KEY, registry, None)
+
+    return registry
+
+
+def get_main_menus():
+    registry = get_menus()
+    return [registry["menus"][menu_id] for menu_id in registry["main_menus"]]
+
+
+def get_page_menus(page):
+    registry = get_menus()
+    return [
+        registry["menus"][menu_id]
+        for menu_id in registry["page_menus"].get(page.pk, [])
+        if menu_id in registry["menus"]
+    ]
+
+
+def invalidate_menus():
+    get_cache().delete(MENUS_KEY)
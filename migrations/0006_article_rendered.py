@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pyusite', '0005_alter_menuitem_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False, help_text='The content rendered from markdown to html', verbose_name='rendered content'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='rendered_hash',
+            field=models.CharField(blank=True, editable=False, help_text='A hash of the content and summary from which the html was rendered', max_length=64, verbose_name='rendered source hash'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='rendered_version',
+            field=models.CharField(blank=True, editable=False, help_text='The version of the renderer (markdown and extensions) with which the html was rendered', max_length=16, verbose_name='renderer version'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='summary_html',
+            field=models.TextField(blank=True, editable=False, help_text='The summary rendered from markdown to html', verbose_name='rendered summary'),
+        ),
+    ]
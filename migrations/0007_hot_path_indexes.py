@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pyusite', '0006_article_rendered'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['display', 'publish_date'], name='pyusite_article_display_pub'),
+        ),
+        migrations.AddIndex(
+            model_name='hanger',
+            index=models.Index(fields=['rack', 'order', 'article'], name='pyusite_hanger_rack_order'),
+        ),
+        migrations.AddIndex(
+            model_name='hanger',
+            index=models.Index(condition=models.Q(('expiration_date__isnull', True)), fields=['rack', 'order'], name='pyusite_hanger_rack_noexp'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(condition=models.Q(('is_home', True)), fields=['is_home'], name='pyusite_page_is_home'),
+        ),
+        migrations.AddIndex(
+            model_name='rack',
+            index=models.Index(fields=['section', 'order'], name='pyusite_rack_section_order'),
+        ),
+        migrations.AddIndex(
+            model_name='section',
+            index=models.Index(fields=['page', 'order'], name='pyusite_section_page_order'),
+        ),
+    ]
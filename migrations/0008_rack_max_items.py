@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pyusite', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rack',
+            name='max_items',
+            field=models.PositiveIntegerField(blank=True, help_text='The most articles to show in the rack at once, with a link to the rest.  Leave blank to show them all', null=True, verbose_name='max items'),
+        ),
+    ]
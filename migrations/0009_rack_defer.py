@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pyusite', '0008_rack_max_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rack',
+            name='defer',
+            field=models.BooleanField(default=False, help_text='Load the rack separately, once the visitor scrolls down to it, instead of with the rest of the page.  Useful for racks in sidebars and far down long pages', verbose_name='defer'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pyusite', '0009_rack_defer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imij',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='The names of the resized copies of the image, by format, as [width, name] pairs from narrowest to widest', verbose_name='derivatives'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:18
+
+from django.db import migrations, models
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# The EXIF tag of the orientation the camera was held in
+ORIENTATION_TAG = 0x0112
+
+
+def store_dimensions(apps, schema_editor):
+    # The size as the image is displayed, with its EXIF orientation applied.
+    # Images whose file cannot be read are left without one
+    if Image is None:
+        return
+
+    Imij = apps.get_model("pyusite", "Imij")
+    storage = Imij._meta.get_field("imagefile").storage
+
+    for pk, name in Imij.objects.values_list("pk", "imagefile"):
+        if not name:
+            continue
+        try:
+            with storage.open(name, "rb") as f:
+                image = Image.open(f)
+                width, height = image.size
+                orientation = image.getexif().get(ORIENTATION_TAG)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            continue
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+        Imij.objects.filter(pk=pk).update(width=width, height=height)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pyusite', '0010_imij_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imij',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='The height of the image in pixels, as it is displayed', null=True, verbose_name='height'),
+        ),
+        migrations.AddField(
+            model_name='imij',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='The width of the image in pixels, as it is displayed', null=True, verbose_name='width'),
+        ),
+        migrations.RunPython(store_dimensions, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,9 @@
 from datetime import date
 from django.db import models
+from django.db.models import Q
 from django.conf import settings
 from django.utils.text import slugify
+from .rendering import get_renderer_version, get_source_hash, render_markdown
 
 class Page(models.Model):
     title = models.CharField(
@@ -43,6 +45,13 @@ class Page(models.Model):
 
     class Meta:
         ordering = ("order", "title")
+        indexes = [
+            models.Index(
+                fields=["is_home"],
+                condition=Q(is_home=True),
+                name="pyusite_page_is_home",
+            ),
+        ]
 
 
 class Section(models.Model):
@@ -104,6 +113,9 @@ class Section(models.Model):
 
     class Meta:
         ordering = ("page", "order")
+        indexes = [
+            models.Index(fields=["page", "order"], name="pyusite_section_page_order"),
+        ]
 
 
 class Rack(models.Model):
@@ -180,6 +192,17 @@ class Rack(models.Model):
     collapse = models.BooleanField(
         "collapse", default=True, help_text="Collapse if there are no hangers/articles"
     )
+    max_items = models.PositiveIntegerField(
+        "max items",
+        blank=True,
+        null=True,
+        help_text="The most articles to show in the rack at once, with a link to the rest.  Leave blank to show them all",
+    )
+    defer = models.BooleanField(
+        "defer",
+        default=False,
+        help_text="Load the rack separately, once the visitor scrolls down to it, instead of with the rest of the page.  Useful for racks in sidebars and far down long pages",
+    )
 
     def __str__(self):
 
@@ -192,6 +215,9 @@ class Rack(models.Model):
             "section",
             "order",
         )
+        indexes = [
+            models.Index(fields=["section", "order"], name="pyusite_rack_section_order"),
+        ]
 
 
 class Document(models.Model):
@@ -228,6 +254,20 @@ class Document(models.Model):
 class Imij(models.Model):
 
     imagefile = models.ImageField("file", upload_to="pyusiteimages")
+    width = models.PositiveIntegerField(
+        "width",
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="The width of the image in pixels, as it is displayed",
+    )
+    height = models.PositiveIntegerField(
+        "height",
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="The height of the image in pixels, as it is displayed",
+    )
     name = models.CharField(
         "name",
         max_length=20,
@@ -244,11 +284,38 @@ class Imij(models.Model):
         blank=True,
         help_text="The default title of the image to be used in rendering.  This is a tool-tip that appears when the user holds the mouse pointer over the image",
     )
+    derivatives = models.JSONField(
+        "derivatives",
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="The names of the resized copies of the image, by format, as [width, name] pairs from narrowest to widest",
+    )
 
     @property
     def markdown_code(self):
         return "![{}]({})".format(self.alt_text, self.imagefile.url)
 
+    def get_dimensions(self):
+        # Imported here, since images imports the models
+        from .images import get_display_size
+
+        return get_display_size(self.imagefile)
+
+    def save(self, *args, **kwargs):
+        # Measured when a file is uploaded, rather than by width_field and
+        # height_field, which open the file whenever an image without them
+        # is loaded and fail if it is missing
+        if self.imagefile and (not self.imagefile._committed or not self.width):
+            self.width, self.height = self.get_dimensions()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = set(kwargs["update_fields"]) | {
+                    "width",
+                    "height",
+                }
+
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -358,12 +425,80 @@ class Article(models.Model):
         on_delete=models.SET_NULL,
         help_text="The image to be displayed when linking to the article on social media",
     )
+    content_html = models.TextField(
+        "rendered content",
+        blank=True,
+        editable=False,
+        help_text="The content rendered from markdown to html",
+    )
+    summary_html = models.TextField(
+        "rendered summary",
+        blank=True,
+        editable=False,
+        help_text="The summary rendered from markdown to html",
+    )
+    rendered_hash = models.CharField(
+        "rendered source hash",
+        max_length=64,
+        blank=True,
+        editable=False,
+        help_text="A hash of the content and summary from which the html was rendered",
+    )
+    rendered_version = models.CharField(
+        "renderer version",
+        max_length=16,
+        blank=True,
+        editable=False,
+        help_text="The version of the renderer (markdown and extensions) with which the html was rendered",
+    )
+
+    rendered_fields = ["content_html", "summary_html", "rendered_hash", "rendered_version"]
+
+    def rendered_is_stale(self):
+        return self.rendered_hash != get_source_hash(
+            self.content, self.summary
+        ) or self.rendered_version != get_renderer_version()
+
+    def render(self, force=False):
+        if not (force or self.rendered_is_stale()):
+            return False
+
+        self.content_html = render_markdown(self.content)
+        self.summary_html = render_markdown(self.summary)
+        self.rendered_hash = get_source_hash(self.content, self.summary)
+        self.rendered_version = get_renderer_version()
+
+        return True
+
+    def get_rendered(self):
+        # Articles saved before the rendered fields existed, or rendered with a
+        # different set of extensions, are rendered once and stored without
+        # touching updated_datetime
+        if self.render():
+            Article.objects.filter(pk=self.pk).update(
+                **{field: getattr(self, field) for field in self.rendered_fields}
+            )
+
+        return {"content": self.content_html, "summary": self.summary_html}
+
+    def save(self, *args, **kwargs):
+        if self.render() and kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = set(kwargs["update_fields"]) | set(
+                self.rendered_fields
+            )
+
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
     class Meta:
         ordering = ("-publish_date", "title")
+        indexes = [
+            models.Index(
+                fields=["display", "publish_date"], name="pyusite_article_display_pub"
+            ),
+        ]
 
 
 class Hanger(models.Model):
@@ -398,6 +533,16 @@ class Hanger(models.Model):
 
     class Meta:
         ordering = ("rack", "order", "article")
+        indexes = [
+            models.Index(
+                fields=["rack", "order", "article"], name="pyusite_hanger_rack_order"
+            ),
+            models.Index(
+                fields=["rack", "order"],
+                condition=Q(expiration_date__isnull=True),
+                name="pyusite_hanger_rack_noexp",
+            ),
+        ]
 
 
 class Tag(models.Model):
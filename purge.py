@@ -0,0 +1,90 @@
+import logging
+import urllib.error
+import urllib.request
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# The headers in which responses list their cache tags, with the separator
+# each one expects between tags
+TAG_HEADER_SEPARATORS = {
+    "Surrogate-Key": " ",
+    "Cache-Tag": ",",
+}
+
+
+def get_edge_settings():
+    return settings.PYUSITE.get("EDGE_CACHE", {})
+
+
+def edge_cache_enabled():
+    return bool(get_edge_settings().get("ENABLED", False))
+
+
+class BasePurgeBackend:
+    """
+    Purges the responses that a CDN or reverse proxy has cached, by the tags
+    listed in their Surrogate-Key or Cache-Tag headers
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def purge_tags(self, tags):
+        raise NotImplementedError
+
+
+class NullPurgeBackend(BasePurgeBackend):
+    def purge_tags(self, tags):
+        pass
+
+
+class HTTPPurgeBackend(BasePurgeBackend):
+    """
+    Sends one request, by default a PURGE to URL with the tags in a
+    Surrogate-Key header, which is how Varnish with the xkey module and
+    most CDNs' purge APIs expect tag purges
+    """
+
+    def purge_tags(self, tags):
+        if not tags:
+            return
+
+        request = urllib.request.Request(
+            self.options["URL"],
+            method=self.options.get("METHOD", "PURGE"),
+            headers=dict(
+                self.options.get("HEADERS", {}),
+                **{self.options.get("HEADER", "Surrogate-Key"): " ".join(sorted(tags))}
+            ),
+        )
+        try:
+            with urllib.request.urlopen(
+                request, timeout=self.options.get("TIMEOUT", 5)
+            ) as response:
+                response.read()
+        except (urllib.error.URLError, OSError) as e:
+            logger.error("Purging tags from {} failed: {}".format(request.full_url, e))
+
+
+_backend = None
+
+
+def get_purge_backend():
+    global _backend
+
+    edge_settings = get_edge_settings()
+    backend_path = edge_settings.get("PURGE_BACKEND", "pyusite.purge.NullPurgeBackend")
+    if _backend is None or _backend[0] != backend_path:
+        _backend = (
+            backend_path,
+            import_string(backend_path)(**edge_settings.get("PURGE_OPTIONS", {})),
+        )
+
+    return _backend[1]
+
+
+def purge_tags(tags):
+    if edge_cache_enabled():
+        get_purge_backend().purge_tags(tags)
@@ -0,0 +1,214 @@
+from datetime import date, datetime
+from typing import NamedTuple, Optional, Tuple
+
+# Compact, immutable records of what the public templates show.  They are
+# built once, cached and shared between requests and threads, so they must
+# never be changed, which is also why their lists are tuples
+
+
+class FileRecord(NamedTuple):
+    name: str
+    url: str
+
+
+class AuthorRecord(NamedTuple):
+    pk: int
+    username: str
+    first_name: str
+    last_name: str
+    is_staff: bool
+
+
+class DocumentRecord(NamedTuple):
+    pk: int
+    title: str
+    show_title: bool
+    slug: str
+    doc_file: FileRecord
+
+
+class ImageRecord(NamedTuple):
+    pk: int
+    name: str
+    alt_text: str
+    title: str
+    imagefile: FileRecord
+
+
+class ArticleRecord(NamedTuple):
+    pk: int
+    slug: str
+    author: Optional[AuthorRecord]
+    created_datetime: datetime
+    updated_datetime: datetime
+    publish_date: date
+    content_classes: str
+    read_more: str
+    title: str
+    show_title: bool
+    summary: str
+    content: str
+    if_summary_blank: int
+    iframe_document: Optional[DocumentRecord]
+    iframe_src: str
+    iframe_height: Optional[int]
+    featured_image: Optional[ImageRecord] = None
+
+
+class HangerRecord(NamedTuple):
+    pk: int
+    article: ArticleRecord
+
+
+class RackRecord(NamedTuple):
+    pk: int
+    width: int
+    title: str = ""
+    show_title: bool = False
+    content_before_articles: str = ""
+    content_after_articles: str = ""
+    hangers: Tuple[HangerRecord, ...] = ()
+    # The cursor of the page of the rack that follows, if it has more
+    # hangers than it shows
+    next: Optional[str] = None
+    # A placeholder, replaced in the browser by the rack's fragment
+    deferred: bool = False
+
+
+class SectionRecord(NamedTuple):
+    pk: int
+    title: str
+    show_title: bool
+    content_before_racks: str
+    content_after_racks: str
+    collapse: bool
+    is_special: bool
+    slug: str
+    racks: Tuple[RackRecord, ...]
+
+
+class PageTree(NamedTuple):
+    sections: Tuple[SectionRecord, ...]
+    special_sections: Tuple[SectionRecord, ...]
+    # The cache tags of everything in the tree
+    tags: frozenset
+
+
+def file_to_record(field_file):
+    if not field_file:
+        return None
+
+    return FileRecord(field_file.name, field_file.url)
+
+
+def author_to_record(user, authors=None):
+    """
+    authors is an optional dict of the records already made, by pk, so that
+    the articles of one author share a record
+    """
+    if user is None:
+        return None
+    if authors is not None and user.pk in authors:
+        return authors[user.pk]
+
+    record = AuthorRecord(
+        user.pk,
+        user.get_username(),
+        getattr(user, "first_name", ""),
+        getattr(user, "last_name", ""),
+        user.is_staff,
+    )
+    if authors is not None:
+        authors[user.pk] = record
+
+    return record
+
+
+def document_to_record(document):
+    if document is None:
+        return None
+
+    return DocumentRecord(
+        document.pk,
+        document.title,
+        document.show_title,
+        document.slug,
+        file_to_record(document.doc_file),
+    )
+
+
+def image_to_record(image):
+    if image is None:
+        return None
+
+    return ImageRecord(
+        image.pk,
+        image.name,
+        image.alt_text,
+        image.title,
+        file_to_record(image.imagefile),
+    )
+
+
+def article_to_record(article, authors=None, featured_image=False):
+    """
+    The featured image is only included if asked for, since the pages do not
+    show it and it would cost a query per article
+    """
+    rendered = article.get_rendered()
+
+    return ArticleRecord(
+        pk=article.pk,
+        slug=article.slug,
+        author=author_to_record(article.author, authors),
+        created_datetime=article.created_datetime,
+        updated_datetime=article.updated_datetime,
+        publish_date=article.publish_date,
+        content_classes=article.content_classes,
+        read_more=article.read_more,
+        title=article.title,
+        show_title=article.show_title,
+        summary=rendered["summary"],
+        content=rendered["content"],
+        if_summary_blank=article.if_summary_blank,
+        iframe_document=document_to_record(article.iframe_document),
+        iframe_src=article.iframe_src,
+        iframe_height=article.iframe_height,
+        featured_image=(
+            image_to_record(article.featured_image) if featured_image else None
+        ),
+    )
+
+
+def rack_to_record(rack, hangers, next_cursor=None, authors=None):
+    return RackRecord(
+        pk=rack.pk,
+        width=rack.width,
+        title=rack.title,
+        show_title=rack.show_title,
+        content_before_articles=rack.content_before_articles,
+        content_after_articles=rack.content_after_articles,
+        hangers=tuple(
+            HangerRecord(hanger.pk, article_to_record(hanger.article, authors))
+            for hanger in hangers
+        ),
+        next=next_cursor,
+    )
+
+
+def deferred_rack_to_record(rack):
+    return RackRecord(pk=rack.pk, width=rack.width, deferred=True)
+
+
+def section_to_record(section, racks):
+    return SectionRecord(
+        pk=section.pk,
+        title=section.title,
+        show_title=section.show_title,
+        content_before_racks=section.content_before_racks,
+        content_after_racks=section.content_after_racks,
+        collapse=section.collapse,
+        is_special=section.is_special,
+        slug=section.slug,
+        racks=tuple(racks),
+    )
@@ -0,0 +1,166 @@
+import hashlib
+import posixpath
+import re
+from urllib.parse import unquote
+from xml.etree import ElementTree
+import markdown
+from django.conf import settings
+from markdown.extensions import Extension
+from markdown.postprocessors import Postprocessor
+from markdown.treeprocessors import Treeprocessor
+
+DEFAULT_MARKDOWN_EXTENSIONS = ["fenced_code", "extra"]
+
+# Bump when pyusite's own markdown processing changes in a way that affects
+# output, so stored html is re-rendered
+RENDERER_REVISION = 4
+
+LAZY_IFRAME_RE = re.compile(r"<iframe(?![^>]*\sloading=)", re.IGNORECASE)
+
+
+def get_markdown_extensions():
+    return settings.PYUSITE.get("MARKDOWN_EXTENSIONS", DEFAULT_MARKDOWN_EXTENSIONS)
+
+
+def get_renderer_version():
+    """
+    A short fingerprint of everything other than the source text that affects
+    rendered html: the markdown library version, the configured extensions,
+    pyusite's own renderer revision and the sizes of responsive images
+    """
+    from .images import get_sizes
+
+    fingerprint = "{}|{}|{}|{}".format(
+        RENDERER_REVISION,
+        markdown.__version__,
+        ",".join(str(extension) for extension in get_markdown_extensions()),
+        get_sizes(),
+    )
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+
+
+def get_source_hash(*sources):
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update((source or "").encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get_media_name(src):
+    # The storage name of a file from its url, if it is a media file
+    if not settings.MEDIA_URL or not (src or "").startswith(settings.MEDIA_URL):
+        return None
+
+    return posixpath.normpath(unquote(src[len(settings.MEDIA_URL) :]))
+
+
+class ImageTreeprocessor(Treeprocessor):
+    """
+    Makes images load lazily, and those that show an Imij get its width and
+    height, so the page does not shift as they load, and if it has
+    derivatives, are wrapped in a picture element whose sources list them,
+    so browsers download the smallest copy that fills the space.  The Imijs
+    are looked up in one query
+    """
+
+    def run(self, root):
+        from .images import FORMATS, get_sizes
+        from .models import Imij
+
+        images = [
+            (parent, child)
+            for parent in root.iter()
+            for child in parent
+            if child.tag == "img"
+        ]
+        if not images:
+            return
+
+        for parent, img in images:
+            img.set("loading", img.get("loading", "lazy"))
+
+        names = {get_media_name(img.get("src")) for parent, img in images} - {None}
+        if not names:
+            return
+
+        imijs = {
+            imij["imagefile"]: imij
+            for imij in Imij.objects.filter(imagefile__in=names).values(
+                "imagefile", "width", "height", "derivatives"
+            )
+        }
+        storage = Imij._meta.get_field("imagefile").storage
+
+        sizes = get_sizes()
+        for parent, img in images:
+            imij = imijs.get(get_media_name(img.get("src")))
+            if imij is None:
+                continue
+
+            # Unless the author has sized the image
+            if imij["width"] and imij["height"] and not (
+                img.get("width") or img.get("height")
+            ):
+                img.set("width", str(imij["width"]))
+                img.set("height", str(imij["height"]))
+
+            if not imij["derivatives"].get("jpeg"):
+                continue
+
+            srcsets = {
+                format_name: ", ".join(
+                    "{} {}w".format(storage.url(name), width) for width, name in names
+                )
+                for format_name, names in imij["derivatives"].items()
+            }
+            # The copies are all narrower than the original, which is the
+            # widest jpeg candidate
+            if imij["width"]:
+                srcsets["jpeg"] += ", {} {}w".format(img.get("src"), imij["width"])
+
+            picture = ElementTree.Element("picture")
+            for format_name, (pillow_format, extension, content_type) in FORMATS.items():
+                if format_name != "jpeg" and srcsets.get(format_name):
+                    ElementTree.SubElement(
+                        picture,
+                        "source",
+                        {
+                            "type": content_type,
+                            "srcset": srcsets[format_name],
+                            "sizes": sizes,
+                        },
+                    )
+
+            # The img, which keeps the original as its src, offers the jpeg
+            # copies to browsers that take none of the sources
+            index = list(parent).index(img)
+            parent.remove(img)
+            parent.insert(index, picture)
+            picture.tail, img.tail = img.tail, None
+            img.set("srcset", srcsets["jpeg"])
+            img.set("sizes", sizes)
+            picture.append(img)
+
+
+class LazyIframePostprocessor(Postprocessor):
+    # Iframes can only come from raw html, which the treeprocessors never see
+    def run(self, text):
+        return LAZY_IFRAME_RE.sub('<iframe loading="lazy"', text)
+
+
+class ImageExtension(Extension):
+    def extendMarkdown(self, md):
+        # After the inline patterns, which make the img elements, and after
+        # raw html is put back
+        md.treeprocessors.register(ImageTreeprocessor(md), "pyusite_images", 15)
+        md.postprocessors.register(
+            LazyIframePostprocessor(md), "pyusite_lazy_iframes", 5
+        )
+
+
+def render_markdown(source):
+    return markdown.markdown(
+        source or "",
+        extensions=get_markdown_extensions() + [ImageExtension()],
+    )
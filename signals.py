@@ -0,0 +1,132 @@
+from django.apps import apps
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from . import caching, images, loaders, menus
+from .models import (
+    Article,
+    Hanger,
+    Imij,
+    Menu,
+    Menuitem,
+    MenuPage,
+    Page,
+    Rack,
+    Section,
+)
+
+CACHED_MODELS = (Article, Hanger, Menu, Menuitem, MenuPage, Page, Rack, Section)
+
+
+def remember_previous_parents(sender, instance, **kwargs):
+    parent_fields = caching.PARENT_FIELDS.get(sender._meta.model_name, [])
+    if not (parent_fields and instance.pk and caching.purging_enabled()):
+        return
+
+    previous = (
+        sender.objects.filter(pk=instance.pk)
+        .values(*["{}_id".format(field_name) for field_name in parent_fields])
+        .first()
+        or {}
+    )
+    instance._pyusite_previous_parents = {
+        field_name: previous.get("{}_id".format(field_name))
+        for field_name in parent_fields
+    }
+
+
+def purge_after_save(sender, instance, **kwargs):
+    if caching.purging_enabled():
+        caching.purge_tags_on_commit(
+            caching.get_instance_tags(
+                instance, getattr(instance, "_pyusite_previous_parents", None)
+            )
+        )
+
+
+def purge_before_delete(sender, instance, **kwargs):
+    # Tags are collected before the delete, while the hangers of an article
+    # still point to it
+    if caching.purging_enabled():
+        caching.purge_tags_on_commit(caching.get_instance_tags(instance))
+
+
+for model in CACHED_MODELS:
+    pre_save.connect(remember_previous_parents, sender=model)
+    post_save.connect(purge_after_save, sender=model)
+    pre_delete.connect(purge_before_delete, sender=model)
+
+
+def bump_structure_version(sender, instance, **kwargs):
+    model_name = sender._meta.model_name
+    transaction.on_commit(lambda: caching.bump_structure_versions([model_name]))
+
+
+for model in (Hanger, Menu, Menuitem, MenuPage, Page, Rack, Section):
+    post_save.connect(bump_structure_version, sender=model)
+    post_delete.connect(bump_structure_version, sender=model)
+
+
+def invalidate_menus(sender, instance, **kwargs):
+    transaction.on_commit(menus.invalidate_menus)
+
+
+for model in (Menu, Menuitem, MenuPage):
+    post_save.connect(invalidate_menus, sender=model)
+    post_delete.connect(invalidate_menus, sender=model)
+
+
+def remember_previous_is_home(sender, instance, **kwargs):
+    instance._pyusite_was_home = bool(
+        instance.pk and Page.objects.filter(pk=instance.pk, is_home=True).exists()
+    )
+
+
+def invalidate_home_page(sender, instance, **kwargs):
+    if instance.is_home or getattr(instance, "_pyusite_was_home", False):
+        transaction.on_commit(loaders.invalidate_home_page)
+
+
+pre_save.connect(remember_previous_is_home, sender=Page)
+post_save.connect(invalidate_home_page, sender=Page)
+post_delete.connect(invalidate_home_page, sender=Page)
+
+
+def remember_previous_imagefile(sender, instance, **kwargs):
+    if not images.derivatives_enabled():
+        return
+
+    instance._pyusite_previous_imagefile = (
+        Imij.objects.filter(pk=instance.pk).values_list("imagefile", flat=True).first()
+        if instance.pk
+        else None
+    )
+
+
+def make_image_derivatives(sender, instance, created, **kwargs):
+    if created or instance.imagefile.name != getattr(
+        instance, "_pyusite_previous_imagefile", None
+    ):
+        images.queue_derivatives(instance.pk)
+
+
+def delete_image_derivatives(sender, instance, **kwargs):
+    transaction.on_commit(lambda: images.delete_derivatives(instance))
+
+
+pre_save.connect(remember_previous_imagefile, sender=Imij)
+post_save.connect(make_image_derivatives, sender=Imij)
+post_delete.connect(delete_image_derivatives, sender=Imij)
+
+
+def bump_generation(sender, **kwargs):
+    transaction.on_commit(caching.bump_generation)
+
+
+# Connected after the receivers above, so that the local caches are emptied
+# after the shared cache is purged
+for model in apps.get_app_config("pyusite").get_models():
+    post_save.connect(bump_generation, sender=model)
+    post_delete.connect(bump_generation, sender=model)
+
+request_started.connect(caching.sync_local_cache)
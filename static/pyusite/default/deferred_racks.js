@@ -0,0 +1,33 @@
+// Replaces the placeholders of deferred racks with the racks themselves when
+// they are about to scroll into view
+
+function loadDeferredRack(placeholder) {
+  fetch(placeholder.dataset["rackUrl"])
+    .then(function(response) { return response.ok ? response.text() : "" })
+    .then(function(html) {
+      placeholder.outerHTML = html
+      if (typeof resizeRacks == "function") {
+        resizeRacks()
+      }
+    })
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+  let placeholders = document.querySelectorAll(".rack-deferred[data-rack-url]")
+
+  if (!("IntersectionObserver" in window)) {
+    placeholders.forEach(loadDeferredRack)
+    return
+  }
+
+  let observer = new IntersectionObserver(function(entries) {
+    for (let entry of entries) {
+      if (entry.isIntersecting) {
+        observer.unobserve(entry.target)
+        loadDeferredRack(entry.target)
+      }
+    }
+  }, { rootMargin: "200px" })
+
+  placeholders.forEach(function(placeholder) { observer.observe(placeholder) })
+})
@@ -0,0 +1,84 @@
+// Loads the options of selects with a data-autocomplete-url as the user
+// searches, instead of rendering every option with the page
+
+function activateAutocomplete(select) {
+  let url = select.dataset["autocompleteUrl"]
+  let filters = JSON.parse(select.dataset["autocompleteFilters"] || "{}")
+  let timer = null
+
+  let search = document.createElement("input")
+  search.type = "search"
+  search.placeholder = "search"
+  search.className = "autocomplete-search"
+  select.parentNode.insertBefore(search, select)
+
+  function loadOptions(after) {
+    let params = new URLSearchParams({ q: search.value })
+    if (after) {
+      params.set("after", after)
+    }
+    for (let [param, id] of Object.entries(filters)) {
+      let filter = document.getElementById(id)
+      if (filter != null && filter.value) {
+        params.set(param, filter.value)
+      }
+    }
+
+    fetch(url + "?" + params.toString(), { credentials: "same-origin" })
+      .then(function(response) { return response.json() })
+      .then(function(data) {
+        for (let option of Array.from(select.options)) {
+          if (option.dataset["after"] || (!after && option.value && !option.selected)) {
+            option.remove()
+          }
+        }
+        for (let result of data.results) {
+          if (Array.from(select.options).some(function(option) { return option.value == String(result.value) })) {
+            continue
+          }
+          let option = new Option(result.text, result.value)
+          for (let [key, value] of Object.entries(result.data)) {
+            if (value != null) {
+              option.dataset[key] = value
+            }
+          }
+          select.add(option)
+        }
+        if (data.next) {
+          let more = new Option("more...", "")
+          more.dataset["after"] = data.next
+          select.add(more)
+        }
+        select.dataset["autocompleteLoaded"] = "true"
+      })
+  }
+
+  search.addEventListener("input", function() {
+    clearTimeout(timer)
+    timer = setTimeout(function() { loadOptions() }, 250)
+  })
+  select.addEventListener("focus", function() {
+    if (!select.dataset["autocompleteLoaded"]) {
+      loadOptions()
+    }
+  })
+  select.addEventListener("change", function() {
+    let option = select.options[select.selectedIndex]
+    if (option != null && option.dataset["after"]) {
+      select.value = ""
+      loadOptions(option.dataset["after"])
+    }
+  })
+  for (let id of Object.values(filters)) {
+    let filter = document.getElementById(id)
+    if (filter != null) {
+      filter.addEventListener("change", function() { loadOptions() })
+    }
+  }
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+  for (let select of document.querySelectorAll("select[data-autocomplete-url]")) {
+    activateAutocomplete(select)
+  }
+})
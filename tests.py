@@ -0,0 +1,597 @@
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .caching import get_entries, get_shared_cache, make_tree_key
+from .loaders import HANGER_ORDERING, build_page_tree, load_rack_page, load_racks
+from .models import Article, Hanger, Menu, Menuitem, Page, Rack, Section
+from .purge import BasePurgeBackend
+from .views import PageView
+from .warming import get_main_menu_urls, warm
+
+
+def seed_page(slug, sections, racks, hangers):
+    """
+    A page with the given number of sections, each with the given number of
+    racks, each holding the given number of articles
+    """
+    page = Page.objects.create(slug=slug, title=slug)
+    for s in range(sections):
+        section = Section.objects.create(
+            page=page, slug="{}-s{}".format(slug, s), order=s
+        )
+        for r in range(racks):
+            rack = Rack.objects.create(
+                section=section, slug="{}-s{}-r{}".format(slug, s, r), order=r
+            )
+            for h in range(hangers):
+                article = Article.objects.create(
+                    title="Article {}".format(h),
+                    slug="{}-s{}-r{}-a{}".format(slug, s, r, h),
+                    content="# Article {}".format(h),
+                    publish_date=date.today() - timedelta(days=h),
+                )
+                Hanger.objects.create(rack=rack, article=article, order=h)
+
+    return page
+
+
+@override_settings(PYUSITE={**settings.PYUSITE, "PAGE_CACHE": {"ENABLED": False}})
+class PageTreeQueryTests(TestCase):
+    def test_query_count_does_not_grow_with_the_page(self):
+        for sections, racks, hangers in ((1, 1, 1), (2, 3, 4), (4, 5, 6)):
+            page = seed_page(
+                "page-{}-{}-{}".format(sections, racks, hangers),
+                sections,
+                racks,
+                hangers,
+            )
+            # Sections, their racks, and the racks' hangers with their articles
+            with self.assertNumQueries(3):
+                tree = build_page_tree(page)
+
+            self.assertEqual(len(tree.sections), sections)
+            self.assertEqual(
+                sum(len(rack.hangers) for rack in tree.sections[0].racks),
+                racks * hangers,
+            )
+
+
+@override_settings(PYUSITE={**settings.PYUSITE, "PAGE_CACHE": {"ENABLED": False}})
+class RackPaginationTests(TestCase):
+    def test_cursors_walk_every_hanger_once_in_order(self):
+        page = seed_page("pagination", 1, 1, 0)
+        rack = Rack.objects.get(section__page=page)
+        rack.max_items = 2
+        rack.save()
+        # Ties in order, and in both order and publish date
+        for i, (order, days_ago) in enumerate(
+            ((0, 0), (0, 0), (0, 1), (1, 0), (1, 2), (1, 2), (1, 2), (2, 5))
+        ):
+            article = Article.objects.create(
+                title="Article {}".format(i),
+                slug="pagination-a{}".format(i),
+                publish_date=date.today() - timedelta(days=days_ago),
+            )
+            Hanger.objects.create(rack=rack, article=article, order=order)
+
+        walked = []
+        record = load_racks([Rack.objects.get(pk=rack.pk)])[rack.pk]
+        while True:
+            self.assertLessEqual(len(record.hangers), rack.max_items)
+            walked.extend(hanger.pk for hanger in record.hangers)
+            if record.next is None:
+                break
+            record = load_rack_page(rack, record.next)
+
+        self.assertEqual(
+            walked,
+            list(
+                rack.hanger_set.order_by(*HANGER_ORDERING).values_list("pk", flat=True)
+            ),
+        )
+
+    def test_malformed_cursor_is_not_found(self):
+        page = seed_page("pagination-malformed", 1, 1, 3)
+        rack = Rack.objects.get(section__page=page)
+
+        for after in ("x", "1.2", "1.not-a-date.3", "1.2020-01-01.x", "1.2.3.4"):
+            with self.subTest(after=after):
+                response = self.client.get(
+                    reverse("pyusite:rack-after", args=[rack.pk, after])
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(PYUSITE={**settings.PYUSITE, "PAGE_CACHE": {"ENABLED": False}})
+class RackEditorQueryTests(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            get_user_model().objects.create_superuser("editor", "", "password")
+        )
+
+    def get_post_data(self, rack):
+        data = {
+            "section": rack.section_id,
+            "title": rack.title,
+            "slug": rack.slug,
+            "width": rack.width,
+            "show_article_meta": rack.show_article_meta,
+            "order": rack.order,
+            "display": rack.display,
+            "hanger_set-INITIAL_FORMS": 0,
+            "hanger_set-MIN_NUM_FORMS": 0,
+            "hanger_set-MAX_NUM_FORMS": 1000,
+        }
+        hangers = list(rack.hanger_set.all())
+        for i, hanger in enumerate(hangers):
+            data.update(
+                {
+                    "hanger_set-{}-id".format(i): hanger.pk,
+                    "hanger_set-{}-rack".format(i): rack.pk,
+                    "hanger_set-{}-article".format(i): hanger.article_id,
+                    "hanger_set-{}-order".format(i): hanger.order + 1,
+                }
+            )
+        # One new hanger
+        data.update(
+            {
+                "hanger_set-{}-rack".format(len(hangers)): rack.pk,
+                "hanger_set-{}-article".format(len(hangers)): hangers[0].article_id,
+                "hanger_set-{}-order".format(len(hangers)): 0,
+                "hanger_set-INITIAL_FORMS": len(hangers),
+                "hanger_set-TOTAL_FORMS": len(hangers) + 1,
+            }
+        )
+
+        return data
+
+    def count_queries(self, method, hangers):
+        page = seed_page("editor-{}-{}".format(method, hangers), 1, 1, hangers)
+        rack = Rack.objects.get(section__page=page)
+        url = reverse("pyusite:rack-update", args=[rack.pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            if method == "get":
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+            else:
+                response = self.client.post(url, self.get_post_data(rack))
+                self.assertEqual(response.status_code, 302)
+                self.assertEqual(rack.hanger_set.count(), hangers + 1)
+
+        return len(queries)
+
+    def test_get_query_count_does_not_grow_with_the_hangers(self):
+        self.assertEqual(self.count_queries("get", 1), self.count_queries("get", 8))
+
+    def test_post_query_count_does_not_grow_with_the_hangers(self):
+        self.assertEqual(
+            self.count_queries("post", 1), self.count_queries("post", 8)
+        )
+
+
+@override_settings(PYUSITE={**settings.PYUSITE, "PAGE_CACHE": {"ENABLED": False}})
+class ArticleEditorQueryTests(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            get_user_model().objects.create_superuser("editor", "", "password")
+        )
+
+    def get_post_data(self, article):
+        data = {
+            "title": article.title,
+            "show_title": article.show_title,
+            "slug": article.slug,
+            "content": article.content,
+            "if_summary_blank": article.if_summary_blank,
+            "publish_date": article.publish_date,
+            "display": article.display,
+            "hanger_set-MIN_NUM_FORMS": 0,
+            "hanger_set-MAX_NUM_FORMS": 1000,
+        }
+        hangers = list(article.hanger_set.all())
+        for i, hanger in enumerate(hangers):
+            data.update(
+                {
+                    "hanger_set-{}-id".format(i): hanger.pk,
+                    "hanger_set-{}-article".format(i): article.pk,
+                    "hanger_set-{}-rack".format(i): hanger.rack_id,
+                    "hanger_set-{}-order".format(i): hanger.order + 1,
+                }
+            )
+        # One new hanger
+        data.update(
+            {
+                "hanger_set-{}-article".format(len(hangers)): article.pk,
+                "hanger_set-{}-rack".format(len(hangers)): hangers[0].rack_id,
+                "hanger_set-{}-order".format(len(hangers)): 0,
+                "hanger_set-INITIAL_FORMS": len(hangers),
+                "hanger_set-TOTAL_FORMS": len(hangers) + 1,
+            }
+        )
+
+        return data
+
+    def count_queries(self, method, racks):
+        page = seed_page("article-editor-{}-{}".format(method, racks), 1, racks, 0)
+        article = Article.objects.create(
+            title="Article", slug="article-editor-{}-{}".format(method, racks)
+        )
+        for order, rack in enumerate(Rack.objects.filter(section__page=page)):
+            Hanger.objects.create(rack=rack, article=article, order=order)
+        url = reverse("pyusite:article-update", args=[article.pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            if method == "get":
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+            else:
+                response = self.client.post(url, self.get_post_data(article))
+                self.assertEqual(response.status_code, 302)
+                self.assertEqual(article.hanger_set.count(), racks + 1)
+
+        return len(queries)
+
+    def test_get_query_count_does_not_grow_with_the_hangers(self):
+        self.assertEqual(self.count_queries("get", 1), self.count_queries("get", 8))
+
+    def test_post_query_count_does_not_grow_with_the_hangers(self):
+        self.assertEqual(
+            self.count_queries("post", 1), self.count_queries("post", 8)
+        )
+
+    def test_rack_editor_renders_only_the_selected_articles(self):
+        page = seed_page("article-editor-choices", 1, 1, 2)
+        other = Article.objects.create(title="Other", slug="article-editor-other")
+        rack = Rack.objects.get(section__page=page)
+
+        response = self.client.get(reverse("pyusite:rack-update", args=[rack.pk]))
+
+        self.assertContains(response, reverse("pyusite:autocomplete-article"))
+        for hanger in rack.hanger_set.all():
+            self.assertContains(
+                response, '<option value="{}" selected>'.format(hanger.article_id)
+            )
+        self.assertNotContains(response, '<option value="{}"'.format(other.pk))
+
+
+@override_settings(
+    PYUSITE={
+        **settings.PYUSITE,
+        "PAGE_CACHE": {"ENABLED": True},
+        "STREAM_PAGES": False,
+    }
+)
+class PagePurgeTests(TestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+
+    def test_saving_an_article_purges_the_pages_and_trees_that_show_it(self):
+        pages = [seed_page("purge-a", 1, 1, 2), seed_page("purge-b", 1, 1, 1)]
+        rack = Rack.objects.get(section__page=pages[0])
+        article = rack.hanger_set.first().article
+        Hanger.objects.create(
+            rack=Rack.objects.get(section__page=pages[1]), article=article, order=5
+        )
+        urls = [reverse("pyusite:page", kwargs={"pk": page.pk}) for page in pages]
+        urls.append(reverse("pyusite:rack", kwargs={"pk": rack.pk}))
+        urls.append(reverse("pyusite:article", kwargs={"pk": article.pk}))
+        tree_keys = [make_tree_key(page.pk) for page in pages]
+
+        for url in urls:
+            self.assertNotContains(self.client.get(url), "Renamed")
+        self.assertEqual(len(get_entries(tree_keys)), len(pages))
+
+        article.title = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+
+        self.assertEqual(get_entries(tree_keys), {})
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), "Renamed")
+
+
+@override_settings(
+    PYUSITE={
+        **settings.PYUSITE,
+        "PAGE_CACHE": {"ENABLED": True, "TIMEOUT": 60, "STALE_TIMEOUT": 600},
+        "STREAM_PAGES": False,
+    }
+)
+class StalePageTests(TestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+        self.page = seed_page("stale", 1, 1, 1)
+        self.url = reverse("pyusite:page", kwargs={"pk": self.page.pk})
+        self.content = self.client.get(self.url).content
+
+    def get_expired(self):
+        # Past the timeout, but within the stale timeout
+        with mock.patch("time.time", return_value=time.time() + 120):
+            return self.client.get(self.url)
+
+    def test_expired_page_is_served_while_the_database_fails(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        with mock.patch(
+            "pyusite.caching.get_refresh_executor", return_value=executor
+        ), mock.patch.object(
+            PageView, "get_object", side_effect=DatabaseError("unavailable")
+        ), self.assertLogs(
+            "pyusite.caching", "ERROR"
+        ):
+            response = self.get_expired()
+            executor.shutdown(wait=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.content)
+
+    def test_expired_page_is_refreshed_once(self):
+        executor = mock.Mock()
+        with mock.patch("pyusite.caching.get_refresh_executor", return_value=executor):
+            for i in range(5):
+                self.assertEqual(self.get_expired().content, self.content)
+
+        self.assertEqual(executor.submit.call_count, 1)
+
+
+# Conditional GETs need a cache shared by every process, which the local
+# memory cache is not
+FILE_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(tempfile.gettempdir(), "pyusite-tests-cache"),
+    }
+}
+
+
+@override_settings(
+    CACHES=FILE_CACHES,
+    PYUSITE={
+        **settings.PYUSITE,
+        "PAGE_CACHE": {"ENABLED": True},
+        "STREAM_PAGES": False,
+    },
+)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+        page = seed_page("conditional", 1, 1, 2)
+        self.rack = Rack.objects.get(section__page=page)
+        self.url = reverse("pyusite:rack", kwargs={"pk": self.rack.pk})
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response["ETag"]
+
+    def test_matching_etag_gets_a_304_without_queries(self):
+        etag = self.get_etag()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_validators_change_when_a_hanger_is_saved(self):
+        etag = self.get_etag()
+
+        hanger = self.rack.hanger_set.first()
+        hanger.order += 10
+        with self.captureOnCommitCallbacks(execute=True):
+            hanger.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_validators_change_when_an_article_is_saved(self):
+        etag = self.get_etag()
+
+        article = self.rack.hanger_set.first().article
+        article.title = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_no_validators_with_a_local_memory_cache(self):
+        with override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+                }
+            }
+        ):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
+    def test_no_validators_with_the_page_cache_off(self):
+        with override_settings(
+            PYUSITE={**settings.PYUSITE, "PAGE_CACHE": {"ENABLED": False}}
+        ):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
+
+class RecordingPurgeBackend(BasePurgeBackend):
+    purged = []
+
+    def purge_tags(self, tags):
+        self.purged.append(set(tags))
+
+
+@override_settings(
+    PYUSITE={
+        **settings.PYUSITE,
+        "PAGE_CACHE": {"ENABLED": False},
+        "EDGE_CACHE": {
+            "ENABLED": True,
+            "PURGE_BACKEND": "pyusite.tests.RecordingPurgeBackend",
+        },
+        "STREAM_PAGES": False,
+    }
+)
+class EdgeCacheTests(TestCase):
+    def setUp(self):
+        RecordingPurgeBackend.purged.clear()
+        self.page = seed_page("edge", 1, 1, 2)
+        self.rack = Rack.objects.get(section__page=self.page)
+        self.url = reverse("pyusite:page", kwargs={"pk": self.page.pk})
+
+    def test_saving_an_article_purges_its_rack_section_and_page(self):
+        article = self.rack.hanger_set.first().article
+        article.title = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+
+        self.assertEqual(len(RecordingPurgeBackend.purged), 1)
+        self.assertLessEqual(
+            {
+                "article:{}".format(article.pk),
+                "rack:{}".format(self.rack.pk),
+                "section:{}".format(self.rack.section_id),
+                "page:{}".format(self.page.pk),
+            },
+            RecordingPurgeBackend.purged[0],
+        )
+
+    def test_anonymous_responses_are_public_and_tagged(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("s-maxage", response["Cache-Control"])
+        surrogate_keys = set(response["Surrogate-Key"].split(" "))
+        self.assertLessEqual(
+            {
+                "page:{}".format(self.page.pk),
+                "section:{}".format(self.rack.section_id),
+                "rack:{}".format(self.rack.pk),
+            },
+            surrogate_keys,
+        )
+        self.assertEqual(set(response["Cache-Tag"].split(",")), surrogate_keys)
+
+    def test_logged_in_responses_are_private_and_untagged(self):
+        self.client.force_login(
+            get_user_model().objects.create_user("visitor", "", "password")
+        )
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("private", response["Cache-Control"])
+        self.assertNotIn("public", response["Cache-Control"])
+        self.assertNotIn("Surrogate-Key", response)
+        self.assertNotIn("Cache-Tag", response)
+
+
+@override_settings(
+    PYUSITE={
+        **settings.PYUSITE,
+        "PAGE_CACHE": {"ENABLED": True},
+        "STREAM_PAGES": False,
+    }
+)
+class WarmingTests(TestCase):
+    def setUp(self):
+        get_shared_cache().clear()
+
+    def test_main_menu_hrefs_are_relative_to_the_site_root(self):
+        page = seed_page("warming-menu", 1, 1, 1)
+        url = reverse("pyusite:page", kwargs={"slug": page.slug})
+        menu = Menu.objects.create(name="Main", level=1000)
+        for order, href in enumerate(
+            (url.lstrip("/"), "https://example.com/", "not/a/url/")
+        ):
+            Menuitem.objects.create(menu=menu, href=href, label=href, order=order)
+
+        self.assertEqual(get_main_menu_urls(), [url])
+
+    def test_warming_caches_the_pages(self):
+        page = seed_page("warming", 1, 1, 1)
+        url = reverse("pyusite:page", kwargs={"pk": page.pk})
+
+        # In this thread, which is the only one to see the test's data
+        results = warm([url, url + "missing/"], concurrency=1)
+
+        self.assertEqual([result["status"] for result in results], [200, 404])
+        self.assertEqual(
+            list(get_entries([make_tree_key(page.pk)])), [make_tree_key(page.pk)]
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+def get_comparable_body(html):
+    # The heads differ, since the Django theme's comes from touglates, and
+    # whitespace does not matter
+    html = html[html.find("<body") :]
+    html = re.sub(r">\s+<", "><", html)
+
+    return re.sub(r"\s+", " ", html).strip()
+
+
+def get_engine_alias(backend_class):
+    for engine in engines.all():
+        if isinstance(engine, backend_class):
+            return engine.name
+
+    return None
+
+
+class ThemeTests(TestCase):
+    def test_django_and_jinja2_themes_render_the_same(self):
+        django_engine = get_engine_alias(DjangoTemplates)
+        try:
+            from django.template.backends.jinja2 import Jinja2
+        except ImportError:
+            self.skipTest("Jinja2 is not installed")
+        jinja2_engine = get_engine_alias(Jinja2)
+        if jinja2_engine is None:
+            self.skipTest("There is no Jinja2 engine in TEMPLATES")
+
+        page = seed_page("themes", 2, 2, 3)
+        rack = Rack.objects.filter(section__page=page).first()
+        article = rack.hanger_set.first().article
+        urls = [
+            reverse("pyusite:page", kwargs={"pk": page.pk}),
+            reverse("pyusite:rack", kwargs={"pk": rack.pk}),
+            reverse("pyusite:rack-fragment", kwargs={"pk": rack.pk}),
+            reverse("pyusite:article", kwargs={"pk": article.pk}),
+        ]
+
+        for url in urls:
+            bodies = []
+            for engine in (django_engine, jinja2_engine):
+                with override_settings(
+                    PYUSITE=dict(
+                        settings.PYUSITE,
+                        PAGE_CACHE={},
+                        STREAM_PAGES=False,
+                        TEMPLATE_BACKEND=engine,
+                    )
+                ):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                bodies.append(get_comparable_body(response.getvalue().decode()))
+
+            with self.subTest(url=url):
+                self.assertEqual(bodies[0], bodies[1])
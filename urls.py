@@ -1,14 +1,13 @@
 from django.conf import settings
 from django.conf.urls.static import static
 from django.http import HttpResponse
-from django.views.generic.base import RedirectView
-from django.urls import path, reverse_lazy
+from django.urls import path
 from . import views
 
 app_name = "pyusite"
 
 urlpatterns = [
-    path("", RedirectView.as_view(url=reverse_lazy("pyusite:homepage"))),
+    path("", views.home_page, name="home"),
     path("homepage/", views.home_page, name="homepage"),
     path("page/", views.PageList.as_view(), name="page-list"),
     path("page/edit/create/", views.PageCreate.as_view(), name="page-create"),
@@ -55,6 +54,16 @@ urlpatterns = [
         views.RackView.as_view(),
         name="rack",
     ),
+    path(
+        "rack/<int:pk>/after/<str:after>/",
+        views.RackView.as_view(),
+        name="rack-after",
+    ),
+    path(
+        "rack/<int:pk>/fragment/",
+        views.RackFragmentView.as_view(),
+        name="rack-fragment",
+    ),
     path("rack/edit/create/", views.RackCreate.as_view(), name="rack-create"),
     path("rack/edit/update/<int:pk>/", views.RackUpdate.as_view(), name="rack-update"),
     path("rack/edit/delete/<int:pk>/", views.RackDelete.as_view(), name="rack-delete"),
@@ -89,5 +98,30 @@ urlpatterns = [
     ),
     path("article/edit/popup/", views.ArticleCreate.as_view(), name="article-popup"),
     path("image/edit/popup/", views.ImijCreate.as_view(), name="imij-popup"),
+    path(
+        "autocomplete/page/",
+        views.PageAutocomplete.as_view(),
+        name="autocomplete-page",
+    ),
+    path(
+        "autocomplete/section/",
+        views.SectionAutocomplete.as_view(),
+        name="autocomplete-section",
+    ),
+    path(
+        "autocomplete/rack/",
+        views.RackAutocomplete.as_view(),
+        name="autocomplete-rack",
+    ),
+    path(
+        "autocomplete/article/",
+        views.ArticleAutocomplete.as_view(),
+        name="autocomplete-article",
+    ),
+    path(
+        "autocomplete/image/",
+        views.ImijAutocomplete.as_view(),
+        name="autocomplete-imij",
+    ),
     path("image/<int:pk>/", views.ImijDetail.as_view(), name="imij-detail"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
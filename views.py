@@ -5,17 +5,27 @@ from django_filters_stoex.views import FilterView
 from django.contrib.auth.mixins import PermissionRequiredMixin
 import logging
 import urllib
-import markdown
+import uuid
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseRedirect, response
+from django.db import transaction
+from django.http import (
+    Http404,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+    response,
+)
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from django.utils.text import slugify
 from django.views.generic import (
     CreateView,
     DeleteView,
     DetailView,
     ListView,
     UpdateView,
+    View,
 )
 from django_filters_stoex.forms import (
     FilterstoreRetrieveForm,
@@ -35,7 +45,27 @@ from pyusite.forms import (
     SectionRackFormset,
 )
 from touglates.templatetags import touglates_tags as touglates
+from .caching import (
+    ConditionalGetMixin,
+    PageCacheMixin,
+    STRUCTURE_MODELS,
+    make_tag,
+    purge_instances,
+)
+from .loaders import (
+    get_home_page_pk,
+    get_page_content_modified,
+    get_page_structure_tags,
+    get_page_visibility_transition,
+    get_rack_content_modified,
+    get_rack_visibility_transition,
+    load_page_tree,
+    load_rack_page,
+    load_racks,
+)
+from .menus import get_main_menus, get_page_menus
 from .models import Article, Articlecomment, Menu, Page, Rack, Imij, Section
+from .records import article_to_record
 
 logger = logging.getLogger(__name__)
 
@@ -57,65 +87,96 @@ def get_modelfields_labels(model):
 
 
 def home_page(request):
-    try:
-        page = Page.objects.filter(is_home=True).first()
-        if page.slug:
-            return HttpResponseRedirect(reverse("pyusite:page", args=[page.slug]))
-        else:
-            return PageView(page.id)
-    except Exception as e:
-        logger.error(e)
-        return HttpResponse("Error retrieving the page")
+    home_page_pk = get_home_page_pk()
+    if home_page_pk is None:
+        logger.error("There is no page marked as the home page")
+        raise Http404("There is no home page")
+
+    return PageView.as_view()(request, pk=home_page_pk)
+
+
+class FormsetsMixin:
+    """
+    For create and update views of objects edited together with inline
+    formsets.  The parent form and every formset are built once per request
+    and validated together, and nothing is written unless all of them are
+    valid.  The parent is saved and the inline rows are bulk inserted,
+    updated and deleted in one transaction
+    """
+
+    formset_classes = {}
+
+    def get_formsets(self):
+        if not hasattr(self, "_formsets"):
+            instance = self.object if self.object is not None else self.model()
+            self._formsets = {}
+            for formsetkey, formsetclass in self.formset_classes.items():
+                if self.request.method in ("POST", "PUT"):
+                    self._formsets[formsetkey] = formsetclass(
+                        self.request.POST, self.request.FILES, instance=instance
+                    )
+                else:
+                    self._formsets[formsetkey] = formsetclass(instance=instance)
 
-
-class PageCreate(CreateView):
-    model = Page
-    form_class = PageForm
-    template_name = "pyusite/edit/page_create.html"
+        return self._formsets
 
     def get_context_data(self, **kwargs):
         context_data = super().get_context_data(**kwargs)
-
-        formsetclasses = {
-            "sections": PageSectionFormset,
-        }
-
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                context_data[formsetkey] = formsetclass(self.request.POST)
-            else:
-                context_data[formsetkey] = formsetclass()
+        context_data.update(self.get_formsets())
 
         return context_data
 
     def form_valid(self, form):
-        response = super().form_valid(form)
-
-        self.object = form.save(commit=False)
-
-        formsetclasses = {
-            "sections": PageSectionFormset,
-        }
-        formsetdata = {}
         formsets_valid = True
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                formsetdata[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                formsetdata[formsetkey] = formsetclass(instance=self.object)
-
-            if (formsetdata[formsetkey]).is_valid():
-                formsetdata[formsetkey].save()
-            else:
-                logger.critical(formsetdata[formsetkey].errors)
+        for formset in self.get_formsets().values():
+            if not formset.is_valid():
+                logger.critical(formset.errors)
                 formsets_valid = False
 
         if not formsets_valid:
             return self.form_invalid(form)
 
-        return response
+        with transaction.atomic():
+            self.object = form.save()
+            for formset in self.get_formsets().values():
+                formset.instance = self.object
+                self.save_formset(formset)
+
+        return HttpResponseRedirect(self.get_success_url())
+
+    def save_formset(self, formset):
+        formset.save(commit=False)
+
+        model = formset.model
+        new_objects = formset.new_objects
+        changed_objects = [obj for obj, changed_data in formset.changed_objects]
+        changed_fields = {
+            model._meta.get_field(field_name).name
+            for obj, changed_data in formset.changed_objects
+            for field_name in changed_data
+            if field_name in formset.form._meta.fields
+        }
+
+        if formset.deleted_objects:
+            model.objects.filter(
+                pk__in=[obj.pk for obj in formset.deleted_objects]
+            ).delete()
+        if new_objects:
+            model.objects.bulk_create(new_objects)
+        if changed_objects and changed_fields:
+            model.objects.bulk_update(changed_objects, changed_fields)
+
+        # bulk writes don't send post_save, which purges the page cache
+        purge_instances(new_objects + changed_objects)
+
+
+class PageCreate(FormsetsMixin, CreateView):
+    model = Page
+    form_class = PageForm
+    template_name = "pyusite/edit/page_create.html"
+    formset_classes = {
+        "sections": PageSectionFormset,
+    }
 
     def get_success_url(self):
         if "popup" in self.request.get_full_path():
@@ -130,57 +191,13 @@ class PageCreate(CreateView):
         return reverse("pyusite:page-detail", kwargs={"pk": self.object.pk})
 
 
-class PageUpdate(UpdateView):
+class PageUpdate(FormsetsMixin, UpdateView):
     model = Page
     form_class = PageForm
     template_name = "pyusite/edit/page_update.html"
-
-    def get_context_data(self, **kwargs):
-        context_data = super().get_context_data(**kwargs)
-
-        formsetclasses = {
-            "sections": PageSectionFormset,
-        }
-
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                context_data[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                context_data[formsetkey] = formsetclass(instance=self.object)
-
-        return context_data
-
-    def form_valid(self, form):
-
-        response = super().form_valid(form)
-
-        self.object = form.save(commit=False)
-
-        formsetclasses = {
-            "sections": PageSectionFormset,
-        }
-        formsetdata = {}
-        formsets_valid = True
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                formsetdata[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                formsetdata[formsetkey] = formsetclass(instance=self.object)
-
-            if (formsetdata[formsetkey]).is_valid():
-                formsetdata[formsetkey].save()
-            else:
-                logger.critical(formsetdata[formsetkey].errors)
-                formsets_valid = False
-
-        if not formsets_valid:
-            return self.form_invalid(form)
-
-        return response
+    formset_classes = {
+        "sections": PageSectionFormset,
+    }
 
     def get_success_url(self):
         return reverse("pyusite:page-detail", kwargs={"pk": self.object.pk})
@@ -229,97 +246,50 @@ class PageList(PermissionRequiredMixin, ListView):
         return context_data
 
 
-class PageView(DetailView):
+class ThemeMixin:
+    """
+    For the views of the public theme, which is rendered with the engine in
+    TEMPLATES whose alias is PYUSITE["TEMPLATE_BACKEND"], by default the
+    first one
+    """
+
+    @property
+    def template_engine(self):
+        return settings.PYUSITE.get("TEMPLATE_BACKEND")
+
+
+class PageView(ThemeMixin, PageCacheMixin, ConditionalGetMixin, DetailView):
     model = Page
     template_name = "{}/page.html".format(settings.PYUSITE["TEMPLATE_DIR"])
+    structure_models = STRUCTURE_MODELS
 
-    def get_context_data(self, **kwargs):
-        md = markdown.Markdown(extensions=["fenced_code", "extra"])
+    def get_content_modified(self):
+        return get_page_content_modified(self.object)
+
+    def get_visibility_transition(self):
+        return get_page_visibility_transition(self.object)
 
+    def get_streaming(self):
+        return settings.PYUSITE.get("STREAM_PAGES", False)
+
+    def get_context_data(self, **kwargs):
         context_data = super().get_context_data(**kwargs)
 
-        sections = []
-        special_sections = []
-
-        for object_section in context_data["object"].section_set.all():
-
-            racks = []
-            for object_rack in object_section.rack_set.all():
-                hangers = []
-                for object_hanger in object_rack.hanger_set.all():
-                    if (
-                        object_hanger.article.display == "Y"
-                        and object_hanger.article.publish_date <= date.today()
-                        and (
-                            object_hanger.expiration_date is None
-                            or object_hanger.expiration_date > date.today()
-                        )
-                    ):
-                        hangers.append(
-                            {
-                                "pk": object_hanger.pk,
-                                "article": {
-                                    "pk": object_hanger.article.pk,
-                                    "slug": object_hanger.article.slug,
-                                    "author": object_hanger.article.author,
-                                    "created_datetime": object_hanger.article.created_datetime,
-                                    "updated_datetime": object_hanger.article.updated_datetime,
-                                    "publish_date": object_hanger.article.publish_date,
-                                    "content_classes": object_hanger.article.content_classes,
-                                    "read_more": object_hanger.article.read_more,
-                                    "title": object_hanger.article.title,
-                                    "show_title": object_hanger.article.show_title,
-                                    "summary": md.convert(
-                                        object_hanger.article.summary
-                                    ),
-                                    "content": md.convert(
-                                        object_hanger.article.content
-                                    ),
-                                    "if_summary_blank": object_hanger.article.if_summary_blank,
-                                    "iframe_document": object_hanger.article.iframe_document,
-                                    "iframe_src": object_hanger.article.iframe_src,
-                                    "iframe_height": object_hanger.article.iframe_height,
-                                },
-                            }
-                        )
-                if hangers:
-                    racks.append(
-                        {
-                            "pk": object_rack.pk,
-                            "width": object_rack.width,
-                            "title": object_rack.title,
-                            "show_title": object_rack.show_title,
-                            "content_before_articles": object_rack.content_before_articles,
-                            "content_after_articles": object_rack.content_after_articles,
-                            "hangers": hangers,
-                        }
-                    )
-            if racks or object_section.collapse==False:
-                new_section = {
-                        "pk": object_section.pk,
-                        "title": object_section.title,
-                        "show_title": object_section.show_title,
-                        "content_before_racks": object_section.content_before_racks,
-                        "content_after_racks": object_section.content_after_racks,
-                        "collapse": object_section.collapse,
-                        "is_special": object_section.is_special,
-                        "slug": object_section.slug,
-                        "racks": racks,
-                    }
-
-                if object_section.is_special:
-                    special_sections.append(new_section)
-                else:
-                    sections.append(new_section)
+        # A streamed page loads its sections once its head has been sent
+        if not self.get_streaming():
+            tree = load_page_tree(self.object)
+            self.cache_tags.update(tree.tags)
 
+            context_data["sections"] = tree.sections
+            context_data["special_sections"] = tree.special_sections
 
-        context_data["sections"] = sections
-        context_data["special_sections"] = special_sections
+        context_data["page_menus"] = get_page_menus(self.object)
+        context_data["main_menus"] = get_main_menus()
 
-        context_data["page_menus"] = Menu.objects.filter(
-            menupage__page=self.get_object()
-        )
-        context_data["main_menus"] = Menu.objects.filter(level__gte=1000)
+        self.cache_tags.add("main_menus")
+        for menus in (context_data["page_menus"], context_data["main_menus"]):
+            for menu in menus:
+                self.cache_tags.add(make_tag("menu", menu["pk"]))
 
         context_data["base_url"] = self.request.build_absolute_uri("/")
 
@@ -332,80 +302,135 @@ class PageView(DetailView):
 
         return context_data
 
+    def render_to_response(self, context, **response_kwargs):
+        if not self.get_streaming():
+            return super().render_to_response(context, **response_kwargs)
+
+        # The headers are sent before the page's articles are loaded, so they
+        # are given the tags of its structure
+        self.cache_tags.update(get_page_structure_tags(self.object))
+
+        return StreamingHttpResponse(self.stream_page(context), **response_kwargs)
+
+    def stream_page(self, context):
+        """
+        Yields the page in parts: everything before its content, which lets
+        the browser fetch the stylesheets and banner while the rest renders,
+        then its sidebars and each section as they are rendered, then the
+        rest of the page
+        """
+        template_dir = settings.PYUSITE["TEMPLATE_DIR"]
+        marker = mark_safe("<!-- {} -->".format(uuid.uuid4().hex))
+
+        head, _, tail = render_to_string(
+            self.get_template_names(),
+            dict(context, stream_marker=marker),
+            self.request,
+            using=self.template_engine,
+        ).partition(marker)
+        yield head
+
+        tree = load_page_tree(self.object)
+        self.cache_tags.update(tree.tags)
+        context = dict(
+            context, sections=tree.sections, special_sections=tree.special_sections
+        )
 
-class RackView(DetailView):
-    model = Rack
-    template_name = "pyusite/edit/{}/rack.html".format(settings.PYUSITE["TEMPLATE_DIR"])
+        before, _, after = render_to_string(
+            "{}/_page_content.html".format(template_dir),
+            dict(context, section_marker=marker),
+            self.request,
+            using=self.template_engine,
+        ).partition(marker)
+        yield before
+
+        for section in tree.sections:
+            yield render_to_string(
+                "{}/_section.html".format(template_dir),
+                dict(context, section=section),
+                self.request,
+                using=self.template_engine,
+            )
 
-    def get_context_data(self, **kwargs):
-        context_data = super().get_context_data(**kwargs)
-        context_data["main_menus"] = Menu.objects.filter(level__gte=1000)
+        yield after
+        yield tail
 
-        context_data["base_url"] = self.request.build_absolute_uri("/")
-
-        return context_data
 
+class RackView(ThemeMixin, PageCacheMixin, ConditionalGetMixin, DetailView):
+    model = Rack
+    template_name = "{}/rack.html".format(settings.PYUSITE["TEMPLATE_DIR"])
+    structure_models = ("hanger", "menu", "menuitem", "rack")
 
-class ArticleCreate(CreateView):
-    model = Article
-    form_class = ArticleForm
-    template_name = "pyusite/edit/article_create.html"
+    def get_content_modified(self):
+        return get_rack_content_modified(self.object)
 
-    def get_initial(self):
-        initial_values = super().get_initial()
-        initial_values["author"] = self.request.user
-        return initial_values
+    def get_visibility_transition(self):
+        return get_rack_visibility_transition(self.object)
 
     def get_context_data(self, **kwargs):
         context_data = super().get_context_data(**kwargs)
 
-        context_data["images"] = Imij.objects.all()
-
-        context_data['pages'] = Page.objects.all()
-        context_data['sections'] = Section.objects.all()
-        context_data['racks'] = Rack.objects.all()
+        if "after" in self.kwargs:
+            try:
+                context_data["rack"] = load_rack_page(
+                    self.object, self.kwargs["after"], tags=self.cache_tags
+                )
+            except ValueError:
+                raise Http404("Invalid rack cursor")
+        else:
+            context_data["rack"] = load_racks([self.object], tags=self.cache_tags)[
+                self.object.pk
+            ]
 
+        context_data["main_menus"] = get_main_menus()
 
-        formsetclasses = {
-            "hangers": ArticleHangerFormset,
-        }
+        self.cache_tags.add("main_menus")
+        for menu in context_data["main_menus"]:
+            self.cache_tags.add(make_tag("menu", menu["pk"]))
 
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                context_data[formsetkey] = formsetclass(self.request.POST)
-            else:
-                context_data[formsetkey] = formsetclass()
+        context_data["base_url"] = self.request.build_absolute_uri("/")
 
         return context_data
 
-    def form_valid(self, form):
-        response = super().form_valid(form)
 
-        self.object = form.save(commit=False)
+class RackFragmentView(ThemeMixin, PageCacheMixin, ConditionalGetMixin, DetailView):
+    """
+    Just the HTML of a rack, which pages fetch to replace the placeholders of
+    deferred racks
+    """
 
-        formsetclasses = {
-            "hangers": ArticleHangerFormset,
-        }
-        formsetdata = {}
-        formsets_valid = True
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                formsetdata[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                formsetdata[formsetkey] = formsetclass(instance=self.object)
+    model = Rack
+    template_name = "{}/_rack.html".format(settings.PYUSITE["TEMPLATE_DIR"])
+    structure_models = ("hanger", "rack")
 
-            if (formsetdata[formsetkey]).is_valid():
-                formsetdata[formsetkey].save()
-            else:
-                logger.critical(formsetdata[formsetkey].errors)
-                formsets_valid = False
+    def get_content_modified(self):
+        return get_rack_content_modified(self.object)
 
-        if not formsets_valid:
-            return self.form_invalid(form)
+    def get_visibility_transition(self):
+        return get_rack_visibility_transition(self.object)
+
+    def get_context_data(self, **kwargs):
+        context_data = super().get_context_data(**kwargs)
+
+        context_data["rack"] = load_racks([self.object], tags=self.cache_tags)[
+            self.object.pk
+        ]
+
+        return context_data
 
-        return response
+
+class ArticleCreate(FormsetsMixin, CreateView):
+    model = Article
+    form_class = ArticleForm
+    template_name = "pyusite/edit/article_create.html"
+    formset_classes = {
+        "hangers": ArticleHangerFormset,
+    }
+
+    def get_initial(self):
+        initial_values = super().get_initial()
+        initial_values["author"] = self.request.user
+        return initial_values
 
     def get_success_url(self):
         if "popup" in self.request.get_full_path():
@@ -421,64 +446,13 @@ class ArticleCreate(CreateView):
         return reverse("pyusite:article-detail", kwargs={"pk": self.object.pk})
 
 
-class ArticleUpdate(UpdateView):
+class ArticleUpdate(FormsetsMixin, UpdateView):
     model = Article
     form_class = ArticleForm
     template_name = "pyusite/edit/article_update.html"
-
-    def get_context_data(self, **kwargs):
-        context_data = super().get_context_data(**kwargs)
-
-        context_data["images"] = Imij.objects.all()
-        context_data['pages'] = Page.objects.all()
-        context_data['sections'] = Section.objects.all()
-        context_data['racks'] = Rack.objects.all()
-
-
-
-        formsetclasses = {
-            "hangers": ArticleHangerFormset,
-        }
-
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                context_data[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                context_data[formsetkey] = formsetclass(instance=self.object)
-
-        return context_data
-
-    def form_valid(self, form):
-
-        response = super().form_valid(form)
-
-        self.object = form.save(commit=False)
-
-        formsetclasses = {
-            "hangers": ArticleHangerFormset,
-        }
-        formsetdata = {}
-        formsets_valid = True
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                formsetdata[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                formsetdata[formsetkey] = formsetclass(instance=self.object)
-
-            if (formsetdata[formsetkey]).is_valid():
-                formsetdata[formsetkey].save()
-            else:
-                logger.critical(formsetdata[formsetkey].errors)
-                formsets_valid = False
-
-        if not formsets_valid:
-            return self.form_invalid(form)
-
-        return response
+    formset_classes = {
+        "hangers": ArticleHangerFormset,
+    }
 
     def get_success_url(self):
         return reverse("pyusite:article-detail", kwargs={"pk": self.object.pk})
@@ -526,88 +500,32 @@ class ArticleList(PermissionRequiredMixin, FilterView):
         return context_data
 
 
-class ArticleView(DetailView):
+class ArticleView(ThemeMixin, PageCacheMixin, ConditionalGetMixin, DetailView):
     model = Article
     template_name = "{}/article.html".format(settings.PYUSITE["TEMPLATE_DIR"])
 
-    def get_context_data(self, *args, **kwargs):
-        md = markdown.Markdown(extensions=["fenced_code", "extra"])
+    def get_content_modified(self):
+        return self.object.updated_datetime
 
+    def get_context_data(self, *args, **kwargs):
         context_data = super().get_context_data(*args, **kwargs)
 
-        article = {
-            "pk": context_data["object"].pk,
-            "slug": context_data["object"].slug,
-            "author": context_data["object"].author,
-            "created_datetime": context_data["object"].created_datetime,
-            "updated_datetime": context_data["object"].updated_datetime,
-            "publish_date": context_data["object"].publish_date,
-            "content_classes": context_data["object"].content_classes,
-            "read_more": context_data["object"].read_more,
-            "title": context_data["object"].title,
-            "show_title": context_data["object"].show_title,
-            "summary": md.convert(context_data["object"].summary),
-            "content": md.convert(context_data["object"].content),
-            "if_summary_blank": context_data["object"].if_summary_blank,
-            "iframe_document": context_data["object"].iframe_document,
-            "iframe_src": context_data["object"].iframe_src,
-            "iframe_height": context_data["object"].iframe_height,
-            "featured_image": context_data["object"].featured_image,
-        }
+        self.cache_tags.add(make_tag("article", context_data["object"].pk))
+
+        article = article_to_record(context_data["object"], featured_image=True)
         context_data["article"] = article
         context_data["object"] = article
 
         return context_data
 
 
-class RackCreate(CreateView):
+class RackCreate(FormsetsMixin, CreateView):
     model = Rack
     form_class = RackForm
     template_name = "pyusite/edit/rack_create.html"
-
-    def get_context_data(self, **kwargs):
-        context_data = super().get_context_data(**kwargs)
-
-        formsetclasses = {
-            "hangers": RackHangerFormset,
-        }
-
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                context_data[formsetkey] = formsetclass(self.request.POST)
-            else:
-                context_data[formsetkey] = formsetclass()
-
-        return context_data
-
-    def form_valid(self, form):
-        response = super().form_valid(form)
-
-        self.object = form.save(commit=False)
-
-        formsetclasses = {
-            "hangers": RackHangerFormset,
-        }
-        formsetdata = {}
-        formsets_valid = True
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                formsetdata[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                formsetdata[formsetkey] = formsetclass(instance=self.object)
-
-            if (formsetdata[formsetkey]).is_valid():
-                formsetdata[formsetkey].save()
-            else:
-                logger.critical(formsetdata[formsetkey].errors)
-                formsets_valid = False
-
-        if not formsets_valid:
-            return self.form_invalid(form)
-
-        return response
+    formset_classes = {
+        "hangers": RackHangerFormset,
+    }
 
     def get_success_url(self):
         if "popup" in self.request.get_full_path():
@@ -623,57 +541,13 @@ class RackCreate(CreateView):
         return reverse("pyusite:rack-detail", kwargs={"pk": self.object.pk})
 
 
-class RackUpdate(UpdateView):
+class RackUpdate(FormsetsMixin, UpdateView):
     model = Rack
     form_class = RackForm
     template_name = "pyusite/edit/rack_update.html"
-
-    def get_context_data(self, **kwargs):
-        context_data = super().get_context_data(**kwargs)
-
-        formsetclasses = {
-            "hangers": RackHangerFormset,
-        }
-
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                context_data[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                context_data[formsetkey] = formsetclass(instance=self.object)
-
-        return context_data
-
-    def form_valid(self, form):
-
-        response = super().form_valid(form)
-
-        self.object = form.save(commit=False)
-
-        formsetclasses = {
-            "hangers": RackHangerFormset,
-        }
-        formsetdata = {}
-        formsets_valid = True
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                formsetdata[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                formsetdata[formsetkey] = formsetclass(instance=self.object)
-
-            if (formsetdata[formsetkey]).is_valid():
-                formsetdata[formsetkey].save()
-            else:
-                logger.critical(formsetdata[formsetkey].errors)
-                formsets_valid = False
-
-        if not formsets_valid:
-            return self.form_invalid(form)
-
-        return response
+    formset_classes = {
+        "hangers": RackHangerFormset,
+    }
 
     def get_success_url(self):
         return reverse("pyusite:rack-detail", kwargs={"pk": self.object.pk})
@@ -713,54 +587,13 @@ class RackList(PermissionRequiredMixin, FilterView):
         return context_data
 
 
-class SectionCreate(CreateView):
+class SectionCreate(FormsetsMixin, CreateView):
     model = Section
     form_class = SectionForm
     template_name = "pyusite/edit/section_create.html"
-
-    def get_context_data(self, **kwargs):
-        context_data = super().get_context_data(**kwargs)
-
-        formsetclasses = {
-            "racks": SectionRackFormset,
-        }
-
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                context_data[formsetkey] = formsetclass(self.request.POST)
-            else:
-                context_data[formsetkey] = formsetclass()
-
-        return context_data
-
-    def form_valid(self, form):
-        response = super().form_valid(form)
-
-        self.object = form.save(commit=False)
-
-        formsetclasses = {
-            "racks": SectionRackFormset,
-        }
-        formsetdata = {}
-        formsets_valid = True
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                formsetdata[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                formsetdata[formsetkey] = formsetclass(instance=self.object)
-
-            if (formsetdata[formsetkey]).is_valid():
-                formsetdata[formsetkey].save()
-            else:
-                logger.critical(formsetdata[formsetkey].errors)
-                formsets_valid = False
-
-        if not formsets_valid:
-            return self.form_invalid(form)
-
-        return response
+    formset_classes = {
+        "racks": SectionRackFormset,
+    }
 
     def get_success_url(self):
         if "popup" in self.request.get_full_path():
@@ -776,57 +609,13 @@ class SectionCreate(CreateView):
         return reverse("pyusite:section-detail", kwargs={"pk": self.object.pk})
 
 
-class SectionUpdate(UpdateView):
+class SectionUpdate(FormsetsMixin, UpdateView):
     model = Section
     form_class = SectionForm
     template_name = "pyusite/edit/section_update.html"
-
-    def get_context_data(self, **kwargs):
-        context_data = super().get_context_data(**kwargs)
-
-        formsetclasses = {
-            "racks": SectionRackFormset,
-        }
-
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                context_data[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                context_data[formsetkey] = formsetclass(instance=self.object)
-
-        return context_data
-
-    def form_valid(self, form):
-
-        response = super().form_valid(form)
-
-        self.object = form.save(commit=False)
-
-        formsetclasses = {
-            "racks": SectionRackFormset,
-        }
-        formsetdata = {}
-        formsets_valid = True
-        for formsetkey, formsetclass in formsetclasses.items():
-            if self.request.POST:
-                formsetdata[formsetkey] = formsetclass(
-                    self.request.POST, instance=self.object
-                )
-            else:
-                formsetdata[formsetkey] = formsetclass(instance=self.object)
-
-            if (formsetdata[formsetkey]).is_valid():
-                formsetdata[formsetkey].save()
-            else:
-                logger.critical(formsetdata[formsetkey].errors)
-                formsets_valid = False
-
-        if not formsets_valid:
-            return self.form_invalid(form)
-
-        return response
+    formset_classes = {
+        "racks": SectionRackFormset,
+    }
 
     def get_success_url(self):
         return reverse("pyusite:section-detail", kwargs={"pk": self.object.pk})
@@ -907,3 +696,107 @@ class ImijCreate(CreateView):
             )
 
         return reverse("pyusite:Imij-detail", kwargs={"pk": self.object.pk})
+
+
+class AutocompleteView(PermissionRequiredMixin, View):
+    """
+    Returns a page of objects as JSON for the editor's autocomplete selects.
+    Objects are matched on a prefix of search_field, which is indexed, and
+    paginated by seeking past the last value of search_field returned
+    """
+
+    model = None
+    search_field = "slug"
+    filter_fields = {}
+    paginate_by = 20
+
+    def get_search_value(self, q):
+        return slugify(q)
+
+    def get_queryset(self):
+        queryset = self.model.objects.order_by(self.search_field)
+
+        q = self.request.GET.get("q", "").strip()
+        if q:
+            queryset = queryset.filter(
+                **{
+                    "{}__startswith".format(self.search_field): self.get_search_value(q)
+                }
+            )
+
+        after = self.request.GET.get("after")
+        if after:
+            queryset = queryset.filter(**{"{}__gt".format(self.search_field): after})
+
+        for param, lookup in self.filter_fields.items():
+            value = self.request.GET.get(param)
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+
+        return queryset
+
+    def get_result(self, obj):
+        return {"value": obj.pk, "text": str(obj), "data": {}}
+
+    def get(self, request, *args, **kwargs):
+        objects = list(self.get_queryset()[: self.paginate_by + 1])
+        has_next = len(objects) > self.paginate_by
+        objects = objects[: self.paginate_by]
+
+        return JsonResponse(
+            {
+                "results": [self.get_result(obj) for obj in objects],
+                "next": getattr(objects[-1], self.search_field) if has_next else None,
+            }
+        )
+
+
+class PageAutocomplete(AutocompleteView):
+    model = Page
+    permission_required = "pyusite.view_page"
+
+
+class SectionAutocomplete(AutocompleteView):
+    model = Section
+    permission_required = "pyusite.view_section"
+    filter_fields = {"page": "page"}
+
+    def get_queryset(self):
+        return super().get_queryset().select_related("page")
+
+    def get_result(self, obj):
+        result = super().get_result(obj)
+        result["data"]["page"] = obj.page_id
+        return result
+
+
+class RackAutocomplete(AutocompleteView):
+    model = Rack
+    permission_required = "pyusite.view_rack"
+    filter_fields = {"page": "section__page", "section": "section"}
+
+    def get_queryset(self):
+        return super().get_queryset().select_related("section__page")
+
+    def get_result(self, obj):
+        result = super().get_result(obj)
+        result["data"]["section"] = obj.section_id
+        result["data"]["page"] = obj.section.page_id if obj.section else None
+        return result
+
+
+class ArticleAutocomplete(AutocompleteView):
+    model = Article
+    permission_required = "pyusite.view_article"
+
+
+class ImijAutocomplete(AutocompleteView):
+    model = Imij
+    permission_required = "pyusite.view_imij"
+    search_field = "name"
+
+    def get_search_value(self, q):
+        return q
+
+    def get_result(self, obj):
+        return {"value": obj.markdown_code, "text": str(obj), "data": {}}
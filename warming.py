@@ -0,0 +1,140 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from urllib.parse import urljoin, urlsplit
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.exception import response_for_exception
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve, reverse
+from .loaders import get_home_page_pk
+from .menus import get_main_menus
+from .models import Article, Page, Rack
+
+
+def get_default_host():
+    for host in settings.ALLOWED_HOSTS:
+        if host not in ("*", "") and not host.startswith("."):
+            return host
+
+    return "localhost"
+
+
+def get_main_menu_urls():
+    # Only the menu items that link to the site itself.  The templates
+    # prefix hrefs with the site's root url, so they are relative to it
+    urls = []
+    for menu in get_main_menus():
+        for menuitem in menu["menuitems"]:
+            parts = urlsplit(menuitem["href"] or "")
+            if parts.scheme or parts.netloc:
+                continue
+            path = urljoin("/", parts.path)
+            try:
+                resolve(path)
+            except Resolver404:
+                continue
+            urls.append(path)
+
+    return urls
+
+
+def get_warm_urls(include_articles=False):
+    """
+    The urls to render to warm the caches, most visited first: the home
+    page, the pages linked from the main menus, the other displayed pages,
+    the fragments of their deferred racks and, if include_articles, the
+    published articles
+    """
+    urls = [reverse("pyusite:home"), reverse("pyusite:homepage")]
+
+    home_page_pk = get_home_page_pk()
+    if home_page_pk is not None:
+        urls.append(reverse("pyusite:page", kwargs={"pk": home_page_pk}))
+
+    urls.extend(get_main_menu_urls())
+
+    pages = Page.objects.filter(display="Y").order_by("order", "title")
+    for pk in pages.values_list("pk", flat=True):
+        urls.append(reverse("pyusite:page", kwargs={"pk": pk}))
+
+    for pk in (
+        Rack.objects.filter(defer=True, section__page__in=pages)
+        .values_list("pk", flat=True)
+        .distinct()
+    ):
+        urls.append(reverse("pyusite:rack-fragment", kwargs={"pk": pk}))
+
+    if include_articles:
+        for pk in Article.objects.filter(
+            display="Y", publish_date__lte=date.today()
+        ).values_list("pk", flat=True):
+            urls.append(reverse("pyusite:article", kwargs={"pk": pk}))
+
+    return list(dict.fromkeys(urls))
+
+
+def render_url(url, host, **headers):
+    """
+    The response of the view of a url to a GET from an anonymous visitor,
+    called directly rather than through the middleware.  Errors are turned
+    into responses as the request handler would
+    """
+    request = RequestFactory().get(url, HTTP_HOST=host, **headers)
+    request.user = AnonymousUser()
+    try:
+        match = resolve(request.path_info)
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, "render"):
+            response.render()
+    except Exception as e:
+        response = response_for_exception(request, e)
+
+    return response
+
+
+def warm_url(url, host):
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = render_url(url, host)
+        # A streamed page is only rendered, and cached, as it is read
+        response.getvalue()
+        seconds = time.perf_counter() - start
+
+    return {
+        "url": url,
+        "status": response.status_code,
+        "seconds": seconds,
+        "queries": len(queries),
+    }
+
+
+def warm_url_in_thread(url, host):
+    try:
+        return warm_url(url, host)
+    finally:
+        # Each thread has its own connection, which would otherwise be left
+        # open when the thread ends
+        connection.close()
+
+
+def warm(urls=None, concurrency=4, host=None, include_articles=False):
+    """
+    Renders the urls, by default those of get_warm_urls, as an anonymous
+    visitor would, so that their responses and fragments are in the page
+    cache before visitors ask for them.  At most concurrency urls are
+    rendered at once, and they are started in order, or with a concurrency
+    of 1, rendered one by one in this thread.  Returns, for each url in
+    order, its status code, render time in seconds and number of queries
+    """
+    if urls is None:
+        urls = get_warm_urls(include_articles)
+    host = host or get_default_host()
+
+    if concurrency <= 1:
+        return [warm_url(url, host) for url in urls]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda url: warm_url_in_thread(url, host), urls))